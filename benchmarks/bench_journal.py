@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+
+"""
+benchmark the main journal operations on a synthetic journal
+
+A journal with a configurable number of topics, years, entries per
+year and attachments per entry is created in a temporary directory,
+backed by a local bare git repo, and the key operations are timed.
+The results are written as JSON, and can be compared against an
+earlier run with --compare, e.g.:
+
+  ./bench_journal.py --topics 10 --years 5 --entries 100 -o new.json
+  ./bench_journal.py ... --compare old.json
+
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import pyjournal2
+import pyjournal2.build_util as build_util
+import pyjournal2.entry_util as entry_util
+import pyjournal2.git_util as git_util
+import pyjournal2.index_util as index_util
+import pyjournal2.shell_util as shell_util
+
+
+def get_args():
+    """parse the commandline arguments"""
+
+    p = argparse.ArgumentParser(description=__doc__,
+                                formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--topics", type=int, default=5,
+                   help="number of topics")
+    p.add_argument("--years", type=int, default=3,
+                   help="number of years per topic")
+    p.add_argument("--entries", type=int, default=50,
+                   help="number of entries per year")
+    p.add_argument("--attachments", type=int, default=2,
+                   help="number of attachments per entry")
+    p.add_argument("--attachment-size", type=int, default=4096,
+                   help="size of each attachment in bytes")
+    p.add_argument("--repeat", type=int, default=3,
+                   help="number of times to repeat each operation")
+    p.add_argument("--no-sphinx", action="store_true",
+                   help="don't time the Sphinx builds")
+    p.add_argument("--keep", action="store_true",
+                   help="don't remove the synthetic journal when done")
+    p.add_argument("-o", "--output", type=str, default=None,
+                   help="file to write the JSON results to (default: stdout)")
+    p.add_argument("--compare", type=str, default=None,
+                   help="a previous JSON results file to compare against")
+    p.add_argument("--threshold", type=float, default=1.25,
+                   help="report an operation as slower if it takes more than this factor times the previous run")
+
+    return p.parse_args()
+
+
+def quiet(func):
+    """return a version of func that doesn't print anything"""
+
+    def wrapper():
+        with open(os.devnull, "w") as null:
+            stdout = sys.stdout
+            sys.stdout = null
+            try:
+                func()
+            finally:
+                sys.stdout = stdout
+    return wrapper
+
+
+def make_journal(root, args):
+    """create a journal (bare repo + working clone) under root and fill it
+    with synthetic entries.  Return the journal defs and the time the
+    init took."""
+
+    defs = {"param_file": os.path.join(root, "pyjournal2rc"),
+            "module_dir": os.path.dirname(os.path.abspath(pyjournal2.__file__)),
+            "thumbnail_size": 0}
+
+    tinit = timeit(quiet(lambda: git_util.init("bench", "benchmark", root, root, defs)), 1)[0]
+
+    source_dir = build_util.get_source_dir(defs)
+    payload = os.urandom(args.attachment_size)
+
+    for t in range(args.topics):
+        topic = "topic{:03d}".format(t)
+        os.makedirs(os.path.join(source_dir, topic), exist_ok=True)
+
+        for y in range(args.years):
+            start = datetime.date(2000 + y, 1, 1)
+            step = max(1, 365 // max(1, args.entries))
+            for n in range(args.entries):
+                date = str(start + datetime.timedelta(days=n*step))
+                edir = os.path.join(source_dir, topic, date)
+                os.makedirs(edir, exist_ok=True)
+
+                etext = entry_util.get_header(date)
+                etext += "synthetic entry {} in {}\n\n".format(n, topic)
+                for a in range(args.attachments):
+                    name = "fig{}.png".format(a)
+                    with open(os.path.join(edir, name), "wb") as f:
+                        f.write(payload + name.encode())
+                    etext += entry_util.download_text(topic, date, name)
+
+                with open(os.path.join(edir, date + ".rst"), "w") as f:
+                    f.write(etext)
+
+    journal_dir = index_util.get_journal_dir(defs)
+    shell_util.run("git add .", cwd=journal_dir)
+    shell_util.run("git commit -q -m 'synthetic journal'", cwd=journal_dir)
+    shell_util.run("git push -q origin HEAD", cwd=journal_dir)
+
+    return defs, tinit
+
+
+def timeit(func, repeat, setup=None):
+    """run func repeat times and return the list of wall times.  The
+    in-process entry index is dropped before each run, so each run
+    sees what a fresh pyjournal.py invocation would."""
+
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        index_util._indices.clear()
+        t0 = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - t0)
+    return times
+
+
+def toc_generation(defs):
+    """discover the topics and entries and write all of the TOC files"""
+    build_util.write_tocs(defs)
+
+
+def run_benchmarks(defs, args):
+    """time each of the operations, returning a dictionary of the
+    results"""
+
+    results = {}
+    counter = [0]
+
+    def new_entry():
+        counter[0] += 1
+        entry_util.entry("topic000", [], [], defs,
+                         string="benchmark entry {}\n".format(counter[0]))
+
+    def continue_entry():
+        _, entries = build_util.get_topic_entries("topic001", defs)
+        entry_util.entry("topic001", [], [], defs,
+                         string="continued\n", use_date=entries[-1])
+
+    results["topic discovery"] = timeit(lambda: [build_util.get_topic_entries(t, defs)
+                                                 for t in build_util.get_topics(defs)],
+                                        args.repeat)
+    results["entry"] = timeit(new_entry, args.repeat)
+    results["continue"] = timeit(continue_entry, args.repeat)
+    results["TOC generation"] = timeit(lambda: toc_generation(defs), args.repeat)
+
+    if args.no_sphinx or shutil.which("sphinx-build") is None:
+        results["full build"] = None
+        results["incremental build"] = None
+    else:
+        results["full build"] = timeit(quiet(lambda: build_util.build(defs, clean=True)),
+                                       args.repeat)
+        results["incremental build"] = timeit(quiet(lambda: build_util.build(defs)),
+                                              args.repeat)
+
+    results["push"] = timeit(quiet(lambda: git_util.push(defs)), args.repeat,
+                             setup=new_entry)
+    results["pull"] = timeit(quiet(lambda: git_util.pull(defs)), args.repeat)
+
+    return results
+
+
+def compare(results, old_file, threshold):
+    """print a comparison of the median times against an older results
+    file.  Return the list of operations that got slower by more than
+    threshold."""
+
+    with open(old_file, "r") as f:
+        old = json.load(f)
+
+    slower = []
+    print("{:20s} {:>10s} {:>10s} {:>8s}".format("operation", "old (s)", "new (s)", "ratio"))
+    for op, r in results["results"].items():
+        o = old["results"].get(op)
+        if r is None or o is None:
+            continue
+
+        ratio = r["median"] / o["median"] if o["median"] > 0 else float("inf")
+        flag = ""
+        if ratio > threshold:
+            slower.append(op)
+            flag = "  SLOWER"
+        print("{:20s} {:10.4f} {:10.4f} {:8.2f}{}".format(op, o["median"], r["median"], ratio, flag))
+
+    return slower
+
+
+def main():
+    """create the journal, run the benchmarks and report"""
+
+    args = get_args()
+
+    root = tempfile.mkdtemp(prefix="pyjournal2-bench-")
+
+    try:
+        t0 = time.perf_counter()
+        defs, tinit = make_journal(root, args)
+        tgen = time.perf_counter() - t0
+
+        times = {"init": [tinit]}
+        times.update(run_benchmarks(defs, args))
+    finally:
+        if not args.keep:
+            shutil.rmtree(root, ignore_errors=True)
+
+    results = {"date": datetime.datetime.now().isoformat(timespec="seconds"),
+               "version": pyjournal2.__version__,
+               "python": platform.python_version(),
+               "platform": platform.platform(),
+               "journal": {"topics": args.topics, "years": args.years,
+                           "entries_per_year": args.entries,
+                           "attachments_per_entry": args.attachments,
+                           "attachment_size": args.attachment_size,
+                           "generation_time": tgen},
+               "results": {}}
+
+    for op, t in times.items():
+        if t is None:
+            results["results"][op] = None
+        else:
+            results["results"][op] = {"median": statistics.median(t),
+                                      "min": min(t), "runs": t}
+
+    if args.output is None:
+        print(json.dumps(results, indent=1))
+    else:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=1)
+
+    if args.compare is not None:
+        if compare(results, args.compare, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
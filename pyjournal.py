@@ -4,10 +4,47 @@
 a simple commandline-driven scientific journal in LaTeX managed by git
 """
 
+import sys
+import time
+
+t_start = time.perf_counter()
+
 import pyjournal2.main_util as main_util
 
 if __name__ == "__main__":
-    tdefs = main_util.read_config()
+
+    # --timing reports how long each stage of the startup and the
+    # command took
+    timing = "--timing" in sys.argv
+    if timing:
+        sys.argv.remove("--timing")
+
+        # and each of the commands (git, make, ...) we run
+        import pyjournal2.shell_util as shell_util
+        commands = []
+        shell_util.add_timing_hook(lambda cmd, dt, rc: commands.append((cmd, dt)))
+
+    # --journal name picks one of the journals in the .pyjournal2rc
+    journal = main_util.get_journal_arg()
+
+    t_import = time.perf_counter()
+    tdefs = main_util.read_config(journal=journal)
+    t_config = time.perf_counter()
     targs = main_util.get_args(tdefs)
-    main_util.main(targs, tdefs)
+    t_args = time.perf_counter()
 
+    try:
+        main_util.main(targs, tdefs)
+    finally:
+        if timing:
+            t_end = time.perf_counter()
+            print("timing:", file=sys.stderr)
+            for stage, dt in [("import", t_import - t_start),
+                              ("read config", t_config - t_import),
+                              ("parse arguments", t_args - t_config),
+                              ("command", t_end - t_args),
+                              ("total", t_end - t_start)]:
+                print("  {:20s} {:8.2f} ms".format(stage, 1000*dt), file=sys.stderr)
+            for cmd, dt in commands:
+                print("    {:18s} {:8.2f} ms  {}".format("shell command", 1000*dt, cmd),
+                      file=sys.stderr)
@@ -1,143 +1,745 @@
 """This module controls building the journal from the entry sources"""
 
+import datetime
+import hashlib
+import json
 import os
-import webbrowser
+import re
+import shutil
+import sys
+import threading
+import time
 
+import pyjournal2.index_util as index_util
 import pyjournal2.shell_util as shell_util
 
+LAYOUTS = ["single", "year", "month"]
+
+# Sphinx applications kept in memory between builds by the daemon, keyed
+# by the journal directory and number of jobs
+_sphinx_apps = {}
+
 def get_source_dir(defs):
     """return the directory where we put the sources"""
     return "{}/journal-{}/source/".format(defs["working_path"], defs["nickname"])
 
 def get_topics(defs):
     """return a list of the currently known topics"""
+    return index_util.get_topics(defs)
+
+def get_topic_entries(topic, defs):
+    """return the sorted lists of years and entries for a topic"""
+    return index_util.get_topic_entries(topic, defs)
+
+def create_topic(topic, defs):
+    """create a new topic directory"""
 
     source_dir = get_source_dir(defs)
-    topics = []
+    try:
+        os.mkdir(os.path.join(source_dir, topic))
+    except:
+        sys.exit("ERROR: unable to create a new topic")
 
-    # get the list of directories in source/ -- these are the topics
-    for d in os.listdir(source_dir):
-        if os.path.isdir(os.path.join(source_dir, d)) and not d.startswith("_"):
-            topics.append(d)
+def write_if_changed(filename, content):
+    """write content to filename, but only if it differs from what is
+    already there.  Leaving unchanged files alone preserves their
+    mtime, so Sphinx will not consider them outdated.  Return True if
+    the file was (re)written"""
 
-    return topics
+    if os.path.isfile(filename):
+        with open(filename, "r") as f:
+            if f.read() == content:
+                return False
 
-def get_topic_entries(topic, defs):
+    with open(filename, "w") as f:
+        f.write(content)
 
-    cwd = os.getcwd()
+    return True
 
+def get_build_stamp(defs):
+    """return a string identifying the parts of the journal that, if
+    changed, require a clean rebuild (the Sphinx configuration, the
+    Makefile and the page layout)"""
+
+    journal_dir = "{}/journal-{}/".format(defs["working_path"], defs["nickname"])
     source_dir = get_source_dir(defs)
-    tdir = os.path.join(source_dir, topic)
 
-    os.chdir(tdir)
+    h = hashlib.sha1()
+    h.update(get_layout(defs).encode("utf-8"))
+    for f in [os.path.join(source_dir, "conf.py"),
+              os.path.join(source_dir, "mathsymbols.tex"),
+              os.path.join(journal_dir, "Makefile")]:
+        h.update(f.encode("utf-8"))
+        if os.path.isfile(f):
+            with open(f, "rb") as sf:
+                h.update(sf.read())
+
+    return h.hexdigest()
+
+def get_jobs(defs, jobs=None):
+    """return the number of parallel Sphinx processes to use: the value
+    passed in, or the "jobs" setting from the .pyjournal2rc, or the
+    number of cores on this machine"""
+
+    if jobs is None:
+        jobs = defs.get("jobs", None)
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    return max(1, int(jobs))
+
+def get_layout(defs):
+    """return the page layout for the topics: "single" (one page per
+    topic, the default), "year" (one page per year) or "month" (one
+    page per month)"""
+
+    layout = defs.get("layout", "single")
+    if layout not in LAYOUTS:
+        sys.exit("ERROR: invalid layout {}, should be one of {}".format(
+            layout, ", ".join(LAYOUTS)))
+    return layout
+
+def toctree(docs):
+    """return the ReST for a toctree linking to docs"""
+
+    tstr = ".. toctree::\n"
+    tstr += "   :maxdepth: 1\n\n"
+    for d in docs:
+        tstr += "   {}\n".format(d)
+    return tstr + "\n"
+
+def write_topic_tocs(tdir, topic, years, entries, layout):
+    """write the TOC files for a topic in directory tdir.  The topic.rst
+    lists the years and each YYYY.rst (or YYYY-MM.rst, for the month
+    layout) includes the individual entries.  For the single layout,
+    everything is included into topic.rst, making a single page, while
+    for the year and month layouts, each year or month is a separate
+    page, linked via a toctree."""
+
+    written = []
+
+    def include_entries(title, prefix):
+        estr = len(title)*"*" + "\n"
+        estr += "{}\n".format(title)
+        estr += len(title)*"*" + "\n\n"
+
+        for entry in [q for q in entries if q.startswith(prefix)]:
+            estr += ".. include:: {}/{}.rst\n".format(entry, entry)
+        return estr
+
+    # we need to create ReST files of the form YYYY.rst.  These
+    # will each then contain the links to the entries for that
+    # year (or the months in that year)
+    for y in years:
+        if layout == "month":
+            months = sorted({q[:7] for q in entries if q.startswith(y)})
+            for m in months:
+                mfile = "{}.rst".format(m)
+                write_if_changed(os.path.join(tdir, mfile),
+                                 include_entries(m, m))
+                written.append(mfile)
+
+            ystr = "****\n"
+            ystr += "{}\n".format(y)
+            ystr += "****\n\n"
+            ystr += toctree(months)
+        else:
+            ystr = include_entries(y, y)
+
+        yfile = "{}.rst".format(y)
+        write_if_changed(os.path.join(tdir, yfile), ystr)
+        written.append(yfile)
+
+    # now write the topic.rst
+    tstr = len(topic)*"#" + "\n"
+    tstr += "{}\n".format(topic)
+    tstr += len(topic)*"#" + "\n"
+
+    if layout == "single":
+        for y in years:
+            tstr += ".. include:: {}.rst\n".format(y)
+    else:
+        tstr += "\n" + toctree(years)
+
+    write_if_changed(os.path.join(tdir, "{}.rst".format(topic)), tstr)
+
+    # remove any year or month files left over from an old layout or
+    # from entries that were removed
+    for f in os.listdir(tdir):
+        if re.match(r"^\d{4}(-\d{2})?\.rst$", f) and f not in written:
+            os.remove(os.path.join(tdir, f))
+
+def get_entry_doc(topic, entry, layout):
+    """return the document (page) an entry ends up on for the layout"""
+    if layout == "single":
+        return "/{}/{}".format(topic, topic)
+    elif layout == "month":
+        return "/{}/{}".format(topic, entry[:7])
+    return "/{}/{}".format(topic, entry[:4])
+
+def write_timeline(defs, source_dir, topic_entries, layout):
+    """write the chronological timeline of the entries across all of the
+    topics: timeline.rst links to a page per year, _timeline/YYYY.rst,
+    which lists each date and links to the entries of that date.
+
+    The entries in each year when the timeline was last written are
+    kept in the state directory, so only the years with new (or
+    removed) entries are regenerated."""
+
+    timeline_dir = os.path.join(source_dir, "_timeline")
+    os.makedirs(timeline_dir, exist_ok=True)
+
+    cache_file = os.path.join(index_util.get_state_dir(defs), "timeline.json")
+    try:
+        with open(cache_file, "r") as cf:
+            cache = json.load(cf)
+    except (OSError, ValueError):
+        cache = {}
+
+    if cache.get("layout") != layout:
+        cache = {"layout": layout, "years": {}}
+
+    # the (date, topic) pairs in each year
+    years = {}
+    for topic in sorted(topic_entries):
+        _, entries = topic_entries[topic]
+        for e in entries:
+            years.setdefault(e[:4], []).append([e, topic])
+
+    for y in years:
+        years[y].sort()
+        yfile = os.path.join(timeline_dir, "{}.rst".format(y))
+        if cache["years"].get(y) == years[y] and os.path.isfile(yfile):
+            continue
+
+        ystr = "****\n"
+        ystr += "{}\n".format(y)
+        ystr += "****\n"
+
+        last = None
+        for e, topic in years[y]:
+            if e != last:
+                ystr += "\n{}\n".format(e)
+                ystr += len(e)*"=" + "\n\n"
+                last = e
+            ystr += "* :doc:`{} <{}>`\n".format(topic, get_entry_doc(topic, e, layout))
+
+        write_if_changed(yfile, ystr)
+
+    for f in os.listdir(timeline_dir):
+        if f.endswith(".rst") and f[:-4] not in years:
+            os.remove(os.path.join(timeline_dir, f))
+
+    tstr = "########\n"
+    tstr += "Timeline\n"
+    tstr += "########\n\n"
+    tstr += "All of the entries, in date order.\n\n"
+    tstr += toctree(["_timeline/{}".format(y) for y in sorted(years)])
+
+    write_if_changed(os.path.join(source_dir, "timeline.rst"), tstr)
+
+    cache["years"] = years
+    tmp_file = "{}.{}.{}.tmp".format(cache_file, os.getpid(), threading.get_ident())
+    with open(tmp_file, "w") as cf:
+        json.dump(cache, cf)
+    os.replace(tmp_file, cache_file)
+
+def write_index(source_dir, topics, timeline=False):
+    """write the index.rst that links to each of the topics (and the
+    timeline)"""
+
+    istr = "Research Journal\n"
+    istr += "================\n\n"
+    istr += ".. toctree::\n"
+    istr += "   :maxdepth: 1\n"
+    istr += "   :caption: Contents:\n\n"
+
+    for topic in sorted(topics):
+        istr += "   {}/{}\n".format(topic, topic)
+
+    if timeline:
+        istr += "   timeline\n"
+
+    istr += "\n"
+    istr += "Indices and tables\n"
+    istr += "==================\n\n"
+    istr += "* :ref:`genindex`\n"
+    istr += "* :ref:`modindex`\n"
+    istr += "* :ref:`search`\n"
+
+    write_if_changed(os.path.join(source_dir, "index.rst"), istr)
+
+def get_profile(defs, topic_entries):
+    """return a dictionary with the number and size of the entries and
+    attachments in each topic, and of the HTML pages that were
+    built"""
 
-    # look over the directories here, they will be in the form YYYY-MM-DD
-    years = []
-    entries = []
-    for d in os.listdir(tdir):
-        if os.path.isdir(os.path.join(tdir, d)):
-            y, _, _ = d.split("-")
-            if y not in years:
-                years.append(y)
-            entries.append(d)
+    source_dir = get_source_dir(defs)
 
-    years.sort()
-    entries.sort()
+    topics = {}
+    for topic, (years, entries) in sorted(topic_entries.items()):
+        tinfo = {"years": len(years), "entries": len(entries),
+                 "entry_bytes": 0, "attachments": 0, "attachment_bytes": 0}
+
+        for e in entries:
+            edir = os.path.join(source_dir, topic, e)
+            for f in index_util.get_entry_files(topic, e, defs):
+                size = os.path.getsize(os.path.join(edir, f))
+                if f == e + ".rst":
+                    tinfo["entry_bytes"] += size
+                else:
+                    tinfo["attachments"] += 1
+                    tinfo["attachment_bytes"] += size
+
+        topics[topic] = tinfo
+
+    html_dir = os.path.join(index_util.get_journal_dir(defs), "build", "html")
+
+    pages = []
+    for root, dirs, files in os.walk(html_dir):
+        dirs[:] = [d for d in dirs if not d.startswith("_")]
+        for f in files:
+            if f.endswith(".html"):
+                name = os.path.join(root, f)
+                pages.append((os.path.relpath(name, html_dir), os.path.getsize(name)))
+
+    pages.sort(key=lambda q: q[1], reverse=True)
+
+    documents = {"count": len(pages),
+                 "html_bytes": sum(q[1] for q in pages),
+                 "largest": [{"page": q[0], "bytes": q[1]} for q in pages[:20]]}
+
+    return {"topics": topics, "documents": documents}
+
+class LineStream:
+    """a file-like object that passes each line written to it to a
+    callback, used to watch the output of an in-process Sphinx"""
+
+    def __init__(self, line_callback):
+        self.line_callback = line_callback
+        self.buffer = ""
+
+    def write(self, text):
+        self.buffer += text
+        while "\n" in self.buffer:
+            line, self.buffer = self.buffer.split("\n", 1)
+            self.line_callback(line + "\n")
+
+    def flush(self):
+        pass
+
+def show_progress(line):
+    """show a line of the Sphinx output as progress: on a terminal,
+    each line replaces the last one, so we see where the build is
+    without scrolling through all of the output.  Warnings and errors
+    are always printed in full.  Call with None at the end to clear
+    the progress line."""
+
+    tty = sys.stdout.isatty()
+
+    if line is None:
+        if tty:
+            sys.stdout.write("\r\033[K")
+            sys.stdout.flush()
+        return
+
+    if "warning" in line.lower() or "error" in line.lower():
+        sys.stdout.write(("\r\033[K" if tty else "") + line)
+    elif tty:
+        width = shutil.get_terminal_size().columns - 1
+        sys.stdout.write("\r\033[K" + line.rstrip()[:width])
+        sys.stdout.flush()
+
+def warm_sphinx_build(defs, jobs, line_callback):
+    """build the HTML with a Sphinx application that we keep in memory
+    between builds, so the environment doesn't need to be loaded from
+    disk each time (this is used by the daemon).  Return the Sphinx
+    status code, or None if Sphinx can't be used in-process, in which
+    case the caller should run "make html" instead."""
 
-    os.chdir(cwd)
+    try:
+        from sphinx.application import Sphinx
+    except ImportError:
+        return None
 
-    return years, entries
+    journal_dir = index_util.get_journal_dir(defs)
+    source_dir = get_source_dir(defs)
+    key = (journal_dir, jobs)
 
-def create_topic(topic, defs):
-    """create a new topic directory"""
+    app = _sphinx_apps.get(key)
 
-    source_dir = get_source_dir(defs)
     try:
-        os.mkdir(os.path.join(source_dir, topic))
-    except:
-        sys.error("unable to create a new topic")
+        if app is None:
+            # conf.py imports journal_info from the journal directory
+            if journal_dir not in sys.path:
+                sys.path.insert(0, journal_dir)
+
+            stream = LineStream(line_callback)
+            app = Sphinx(source_dir, source_dir,
+                         os.path.join(journal_dir, "build", "html"),
+                         os.path.join(journal_dir, "build", "doctrees"),
+                         "html", status=stream, warning=stream,
+                         parallel=jobs)
+            _sphinx_apps[key] = app
+        else:
+            # the callback may be for a different build
+            app._status.line_callback = line_callback
+            app._warning.line_callback = line_callback
+
+        app.build()
+    except Exception as e:
+        # start from a fresh application next time
+        _sphinx_apps.pop(key, None)
+        line_callback("ERROR: in-process Sphinx build failed: {}\n".format(e))
+        return None
+
+    return app.statuscode
+
+def write_tocs(defs):
+    """write the TOC files of all of the topics and the main index,
+    without building anything (for the builders other than HTML)"""
+
+    source_dir = get_source_dir(defs)
+    layout = get_layout(defs)
+
+    topics = get_topics(defs)
+    topic_entries = {topic: get_topic_entries(topic, defs) for topic in topics}
+    for topic in topics:
+        years, entries = topic_entries[topic]
+        write_topic_tocs(os.path.join(source_dir, topic), topic,
+                         years, entries, layout)
+
+    write_timeline(defs, source_dir, topic_entries, layout)
+    write_index(source_dir, topics, timeline=True)
+
 
-def build(defs, show=0):
+def build(defs, show=0, clean=False, jobs=None, profile=False, changed_topics=None):
     """build the journal.  This entails writing the TOC files that link to
-    the individual entries and then running the Sphinx make command
+    the individual entries and then running the Sphinx make command.
+
+    The build is incremental: a TOC file is only rewritten if its
+    content changed and we only do a "make clean" if asked to (clean
+    = True) or if the Sphinx configuration changed since the last
+    build.
+
+    Sphinx reads and writes the documents using jobs processes (see
+    get_jobs()).  The time spent in each phase, including each of the
+    phases of the Sphinx build, is reported at the end.  If profile =
+    True, the timings, together with the number and size of the
+    entries, attachments and pages, are also written as JSON to
+    build/html/build-profile.json.
+
+    If changed_topics is given, only the TOC files of those topics are
+    regenerated (this is used by watch, which knows what changed).
 
     """
 
+    timings = []
+    t0 = time.perf_counter()
+    t_start = t0
+
     source_dir = get_source_dir(defs)
 
     topics = get_topics(defs)
+    if changed_topics is None:
+        changed_topics = topics
+    topic_entries = {topic: get_topic_entries(topic, defs)
+                     for topic in topics if topic in changed_topics}
 
-    # for each topic, we want to create a "topic.rst" that then has
-    # things subdivided by year-month, and that a
-    # "topic-year-month.rst" that includes the individual entries
-    for topic in topics:
-        years, entries = get_topic_entries(topic, defs)
-        tdir = os.path.join(source_dir, topic)
-        os.chdir(tdir)
+    t1 = time.perf_counter()
+    timings.append(("topic discovery", t1 - t0))
 
-        # we need to create ReST files of the form YYYY.rst.  These
-        # will each then contain the links to the entries for that
-        # year
-        for y in years:
-            y_entries = [q for q in entries if q.startswith(y)]
+    # for each topic, we want to create a "topic.rst" that then has
+    # things subdivided by year (and month), with the individual
+    # entries included into those
+    layout = get_layout(defs)
+
+    for topic in topic_entries:
+        years, entries = topic_entries[topic]
+        write_topic_tocs(os.path.join(source_dir, topic), topic,
+                         years, entries, layout)
+
+    # the timeline needs all of the topics (this is cheap, since the
+    # entry index is cached)
+    write_timeline(defs, source_dir,
+                   {topic: topic_entries[topic] if topic in topic_entries
+                    else get_topic_entries(topic, defs) for topic in topics},
+                   layout)
+    write_index(source_dir, topics, timeline=True)
+
+    t0 = t1
+    t1 = time.perf_counter()
+    timings.append(("TOC generation", t1 - t0))
 
-            with open("{}.rst".format(y), "w") as yf:
-                yf.write("****\n")
-                yf.write("{}\n".format(y))
-                yf.write("****\n\n")
+    # now do the building
+    build_dir = "{}/journal-{}/".format(defs["working_path"], defs["nickname"])
 
-                # yf.write(".. toctree::\n")
-                # yf.write("   :maxdepth: 2\n")
-                # yf.write("   :caption: Contents:\n\n")
+    # a clean build is needed only if requested or if the
+    # configuration changed since the last build
+    stamp_file = os.path.join(build_dir, "build", ".pyjournal2-stamp")
+    stamp = get_build_stamp(defs)
 
-                # for entry in y_entries:
-                #     yf.write("   {}/{}.rst\n".format(entry, entry))
+    old_stamp = None
+    if os.path.isfile(stamp_file):
+        with open(stamp_file, "r") as sf:
+            old_stamp = sf.read().strip()
 
-                for entry in y_entries:
-                    yf.write(".. include:: {}/{}.rst\n".format(entry, entry))
+    clean = clean or old_stamp != stamp
+    if clean:
+        # an in-memory Sphinx would still have the old environment
+        for key in [k for k in _sphinx_apps if k[0] == index_util.get_journal_dir(defs)]:
+            del _sphinx_apps[key]
 
-        # now write the topic.rst
-        with open("{}.rst".format(topic), "w") as tf:
-            tf.write(len(topic)*"#" + "\n")
-            tf.write("{}\n".format(topic))
-            tf.write(len(topic)*"#" + "\n")
+        _, _, rc = shell_util.run("make clean", cwd=build_dir)
 
-            for y in years:
-                tf.write(".. include:: {}.rst\n".format(y))
+        t0 = t1
+        t1 = time.perf_counter()
+        timings.append(("make clean", t1 - t0))
 
+    # Sphinx announces each phase of the build with a line like
+    # "reading sources... [ 50%] ...", so we time the phases by
+    # watching for those as the output arrives
+    sphinx_phases = []
 
-    # now write the index.rst
-    os.chdir(source_dir)
-    with open("index.rst", "w") as mf:
-        mf.write("Research Journal\n")
-        mf.write("================\n\n")
-        mf.write(".. toctree::\n")
-        mf.write("   :maxdepth: 1\n")
-        mf.write("   :caption: Contents:\n\n")
+    def watch(line):
+        m = re.match(r"^([a-z][a-z ]*[a-z])\.\.\.", line)
+        if m and (not sphinx_phases or sphinx_phases[-1][0] != m.group(1)):
+            sphinx_phases.append((m.group(1), time.perf_counter()))
+        show_progress(line)
 
-        for topic in sorted(topics):
-            mf.write("   {}/{}\n".format(topic, topic))
+    jobs = get_jobs(defs, jobs)
 
-        mf.write("\n")
-        mf.write("Indices and tables\n")
-        mf.write("==================\n\n")
-        mf.write("* :ref:`genindex`\n")
-        mf.write("* :ref:`modindex`\n")
-        mf.write("* :ref:`search`\n")
+    rc = None
+    if defs.get("daemon"):
+        rc = warm_sphinx_build(defs, jobs, watch)
 
+    if rc is None:
+        _, _, rc = shell_util.run("make html SPHINXOPTS='-j {}'".format(jobs),
+                                  line_callback=watch, cwd=build_dir)
+    show_progress(None)
 
-    # now do the building
-    build_dir = "{}/journal-{}/".format(defs["working_path"], defs["nickname"])
-    os.chdir(build_dir)
+    t0 = t1
+    t1 = time.perf_counter()
+    timings.append(("sphinx build ({} jobs)".format(jobs), t1 - t0))
 
-    _, _, rc = shell_util.run("make clean")
-    _, _, rc = shell_util.run("make html")
+    sphinx_timings = []
+    for n, (phase, ts) in enumerate(sphinx_phases):
+        te = sphinx_phases[n+1][1] if n+1 < len(sphinx_phases) else t1
+        sphinx_timings.append((phase, te - ts))
 
     if rc != 0:
         print("build may have been unsuccessful")
+    else:
+        with open(stamp_file, "w") as sf:
+            sf.write(stamp + "\n")
+
+    for phase, dt in timings:
+        print("  {:30s} {:8.3f} s".format(phase, dt))
+    for phase, dt in sphinx_timings:
+        print("    {:28s} {:8.3f} s".format(phase, dt))
+
+    if profile:
+        report = {"date": datetime.datetime.now().isoformat(timespec="seconds"),
+                  "jobs": jobs, "layout": layout, "clean": clean,
+                  "returncode": rc,
+                  "total": time.perf_counter() - t_start,
+                  "timings": [{"phase": phase, "seconds": dt}
+                              for phase, dt in timings],
+                  "sphinx_timings": [{"phase": phase, "seconds": dt}
+                                     for phase, dt in sphinx_timings]}
+        report.update(get_profile(defs, topic_entries))
+
+        # a failed build may not have made build/html, but that is
+        # when the profile is most useful
+        html_dir = os.path.join(build_dir, "build", "html")
+        os.makedirs(html_dir, exist_ok=True)
+        profile_file = os.path.join(html_dir, "build-profile.json")
+        with open(profile_file, "w") as pf:
+            json.dump(report, pf, indent=1)
+
+        print("profile written to {}".format(profile_file))
 
     index = os.path.join(build_dir, "build/html/index.html")
 
     # use webbrowser module
     if show == 1:
+        import webbrowser
+        webbrowser.open_new_tab(index)
+
+    return rc
+
+def _build_journal(defs, clean, jobs):
+    """build one journal for build_all(), in a worker process.  Return
+    the return code, the time taken and the output of the build."""
+
+    import contextlib
+    import io
+
+    output = io.StringIO()
+    t0 = time.perf_counter()
+    try:
+        with contextlib.redirect_stdout(output), contextlib.redirect_stderr(output):
+            rc = build(defs, clean=clean, jobs=jobs)
+    except SystemExit as e:
+        if isinstance(e.code, str):
+            output.write(e.code + "\n")
+        rc = 1 if e.code else 0
+    except Exception as e:
+        output.write("ERROR: {}: {}\n".format(type(e).__name__, e))
+        rc = 1
+
+    return rc, time.perf_counter() - t0, output.getvalue()
+
+def build_all(defs, clean=False, jobs=None):
+    """build all of the journals in the .pyjournal2rc.  Several journals
+    are built at once, in a pool of processes, but the total number of
+    Sphinx processes is at most jobs (see get_jobs()): each of the
+    journals built at the same time gets an equal share of them.  The
+    output and status of each journal is reported when it finishes."""
+
+    import concurrent.futures
+
+    # pyjournal2.main_util imports us, so we import it here
+    import pyjournal2.main_util as main_util
+
+    names = defs.get("journals", [])
+    if not names:
+        sys.exit("ERROR: no journals found in {}".format(defs["param_file"]))
+
+    journal_defs = {name: main_util.read_config(defs["param_file"], journal=name)
+                    for name in names}
+
+    total = get_jobs(defs, jobs)
+    nparallel = min(len(names), total)
+    share = max(1, total // nparallel)
+
+    print("building {} journals, {} at a time with {} Sphinx jobs each".format(len(names),
+                                                                             nparallel, share))
+
+    status = {}
+    with concurrent.futures.ProcessPoolExecutor(max_workers=nparallel) as pool:
+        futures = {pool.submit(_build_journal, journal_defs[name], clean, share): name
+                   for name in names}
+        for f in concurrent.futures.as_completed(futures):
+            name = futures[f]
+            rc, dt, output = f.result()
+            status[name] = (rc, dt)
+
+            print("")
+            print("== {}: {} ({:.2f} s)".format(name, "ok" if rc == 0 else "FAILED", dt))
+            print(output, end="")
+
+    print("")
+    print("{:20s} {:8s} {:>8s}".format("journal", "status", "time (s)"))
+    for name in names:
+        rc, dt = status[name]
+        print("{:20s} {:8s} {:8.2f}".format(name, "ok" if rc == 0 else "failed", dt))
+
+    if any(rc != 0 for rc, _ in status.values()):
+        sys.exit("ERROR: some of the journals did not build")
+
+def stage_partial(defs, topics, since=None, until=None):
+    """set up the source directory for a partial build in
+    build/partial/source: it has the TOC files for just the selected
+    topics and the entries between since and until (YYYY-MM-DD,
+    inclusive), with the entry directories linked from the real
+    source.  Return the staging directory and the number of entries
+    selected."""
+
+    source_dir = get_source_dir(defs)
+    stage_dir = os.path.join(index_util.get_journal_dir(defs), "build", "partial", "source")
+    os.makedirs(stage_dir, exist_ok=True)
+
+    layout = get_layout(defs)
+    nentries = 0
+
+    for topic in topics:
+        _, entries = get_topic_entries(topic, defs)
+        entries = [e for e in entries
+                   if (since is None or e >= since) and (until is None or e <= until)]
+        years = sorted({e.split("-")[0] for e in entries})
+
+        tdir = os.path.join(stage_dir, topic)
+        os.makedirs(tdir, exist_ok=True)
+
+        # link the selected entries and unlink any from an earlier
+        # selection
+        for f in os.listdir(tdir):
+            if os.path.islink(os.path.join(tdir, f)) and f not in entries:
+                os.remove(os.path.join(tdir, f))
+
+        for e in entries:
+            link = os.path.join(tdir, e)
+            if not os.path.islink(link):
+                os.symlink(os.path.join(source_dir, topic, e), link)
+
+        write_topic_tocs(tdir, topic, years, entries, layout)
+        nentries += len(entries)
+
+    # and remove the topics that are no longer selected
+    for f in os.listdir(stage_dir):
+        fpath = os.path.join(stage_dir, f)
+        if os.path.isdir(fpath) and not os.path.islink(fpath) and f not in topics:
+            shutil.rmtree(fpath)
+
+    write_index(stage_dir, topics)
+
+    return stage_dir, nentries
+
+def partial_build(defs, topics=None, since=None, until=None, show=0, clean=False, jobs=None):
+    """build only some topics (all of them if topics is None) and
+    the entries between since and until into build/partial/html, for
+    a quick preview.  This uses the same Sphinx configuration as the
+    full build, but a separate staging source directory (see
+    stage_partial()) and output directory, so it doesn't disturb the
+    full build."""
+
+    t0 = time.perf_counter()
+
+    all_topics = get_topics(defs)
+    if topics is None:
+        topics = all_topics
+    topics = sorted(set(topics))
+    for topic in topics:
+        if topic not in all_topics:
+            sys.exit("ERROR: topic {} does not exist".format(topic))
+
+    for date in [since, until]:
+        if date is not None and not re.match(r"^\d{4}(-\d{2}(-\d{2})?)?$", date):
+            sys.exit("ERROR: dates need to be of the form YYYY-MM-DD, YYYY-MM or YYYY")
+
+    # a partial date means the start (for since) or the whole (for
+    # until) of that year or month
+    if until is not None and len(until) < 10:
+        until += "~"
+
+    stage_dir, nentries = stage_partial(defs, topics, since=since, until=until)
+
+    if nentries == 0:
+        sys.exit("ERROR: no entries match the selection")
+
+    journal_dir = index_util.get_journal_dir(defs)
+
+    partial_dir = os.path.join("build", "partial")
+    if clean:
+        shutil.rmtree(os.path.join(journal_dir, partial_dir, "html"), ignore_errors=True)
+        shutil.rmtree(os.path.join(journal_dir, partial_dir, "doctrees"), ignore_errors=True)
+
+    # -c keeps the configuration (and with it the static files and
+    # templates) from the real source directory
+    jobs = get_jobs(defs, jobs)
+    _, _, rc = shell_util.run("make html SOURCEDIR={} BUILDDIR={} SPHINXOPTS='-j {} -c {}'".format(
+        os.path.relpath(stage_dir, journal_dir), partial_dir, jobs,
+        os.path.relpath(get_source_dir(defs), journal_dir)),
+                              line_callback=show_progress, cwd=journal_dir)
+    show_progress(None)
+
+    if rc != 0:
+        print("build may have been unsuccessful")
+
+    index = os.path.join(journal_dir, partial_dir, "html", "index.html")
+    print("built {} entries from {} in {:.3f} s: {}".format(nentries, ", ".join(topics),
+                                                             time.perf_counter() - t0, index))
+
+    if show == 1:
+        import webbrowser
         webbrowser.open_new_tab(index)
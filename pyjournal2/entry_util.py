@@ -2,10 +2,13 @@
 
 import datetime
 import os
-import shutil
+import shlex
 import sys
+import threading
 
+import pyjournal2.image_util as image_util
 import pyjournal2.shell_util as shell_util
+import pyjournal2.store_util as store_util
 
 FIGURE_STR = r"""
 .. _@figlabel@:
@@ -18,10 +21,26 @@ FIGURE_STR = r"""
 .. reference this as :numref:`@figlabel@`
 """
 
+THUMBNAIL_STR = r"""
+.. _@figlabel@:
+.. figure:: @thumbname@
+   :scale: 80%
+   :align: center
+
+   The caption goes here
+
+   :download:`full-size image <@figname@>`
+
+.. reference this as :numref:`@figlabel@`
+"""
+
 SYMBOLS = r"""
 .. special characters: αβγδεζηθικλμνξοπρστυφχψω ΓΔΘΛΞΠΣΦΨΩ —
 .. you can add an entry to the index via '.. index:: key'"""
 
+# serializes the git commits made by the threads of this process
+_commit_lock = threading.Lock()
+
 WARNING = '\033[93m'
 SUCCESS = '\033[92m'
 FAIL = '\033[91m'
@@ -58,14 +77,128 @@ def get_unique_string():
     now = datetime.datetime.now()
     return str(now.replace(microsecond=0)).replace(" ", "_").replace(":", ".")
 
-def entry(topic, images, link_file, defs, string=None, use_date=None):
-    """create an entry"""
+def get_entry_dir(topic, entry_dir, defs):
+    """return the directory holding the entry entry_dir (YYYY-MM-DD)
+    for the topic"""
+    return "{}/journal-{}/source/{}/{}/".format(defs["working_path"],
+                                               defs["nickname"],
+                                               topic,
+                                               entry_dir)
+
+def get_header(entry_dir):
+    """return the header for a new entry file"""
+    header = len(entry_dir)*"=" + "\n" + "{}\n".format(entry_dir) + len(entry_dir)*"=" + "\n"
+    header += SYMBOLS + "\n\n"
+    return header
+
+def paragraph_break(filename):
+    """return the newlines to append to filename so that what follows
+    starts a new paragraph"""
+
+    with open(filename, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        f.seek(max(0, size - 2))
+        tail = f.read()
+
+    if size == 0 or tail.endswith(b"\n\n"):
+        return ""
+    elif tail.endswith(b"\n"):
+        return "\n"
+    return "\n\n"
+
+def figure_text(topic, entry_dir, im_copy, unique_id, thumb_copy=None):
+    """return the figure directive for the image im_copy that lives in
+    the directory of entry entry_dir.  If thumb_copy is given, the
+    figure shows that (web-sized) version of the image, with a link to
+    the full-size image"""
+
+    # create a unique label for latex referencing
+    idx = im_copy.lower().rfind(".jpg")
+    idx = max(idx, im_copy.lower().rfind(".png"))
+    idx = max(idx, im_copy.lower().rfind(".pdf"))
+    if idx < 0:
+        idx = len(os.path.splitext(im_copy)[0])
+
+    im0 = "{}:{}".format(unique_id, im_copy[:idx])
+
+    if thumb_copy is None:
+        template = FIGURE_STR
+    else:
+        template = THUMBNAIL_STR.replace("@thumbname@", "/{}/{}/{}".format(topic, entry_dir, thumb_copy))
+
+    ftext = ""
+    for l in template.split("\n"):
+        ftext += "{}\n".format(
+            l.replace("@figname@", "/{}/{}/{}".format(topic, entry_dir, im_copy)).replace("@figlabel@", im0).rstrip())
+    return ftext
+
+def download_text(topic, entry_dir, im_copy):
+    """return the download directive for the file im_copy that lives in
+    the directory of entry entry_dir"""
+    return ":download:`{} </{}/{}/{}>`\n\n".format(im_copy, topic, entry_dir, im_copy)
+
+def copy_files(copies, defs, max_workers=None):
+    """copy each (src, dest) pair in copies (through the attachment
+    store), using a pool of threads so that many small files are
+    copied concurrently.  Return the list of files to commit, in the
+    same order (this is dest, or the pointer file of a large file)."""
+
+    # concurrent.futures is slow to import, so we only do so when needed
+    import concurrent.futures
+
+    def copy_one(pair):
+        src, dest = pair
+        try:
+            return store_util.place(src, dest, defs)
+        except OSError:
+            return None
+
+    committed = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as pool:
+        for pair, cfile in zip(copies, pool.map(copy_one, copies)):
+            if cfile is None:
+                sys.exit("ERROR: unable to copy {} to {}".format(*pair))
+            committed.append(cfile)
+
+    return committed
+
+def copy_name(src, odir, taken, unique_id):
+    """return (name, new) for the file src going in the entry directory
+    odir.  If an identical file with the same name is already there,
+    it is reused (new is False).  Otherwise the name is made unique
+    among taken (the names that are or will be in the directory) and
+    added to it."""
+
+    name = os.path.basename(src)
+    if name in taken and store_util.same_file(src, os.path.join(odir, name)):
+        return name, False
+
+    # a large file is committed as name.ref, so that is taken too
+    n = 0
+    while name in taken or name + store_util.REF_EXT in taken:
+        n += 1
+        name = "{}_{}_{}".format(unique_id.replace(".", "_"), n, os.path.basename(src))
+
+    taken.add(name)
+    return name, True
+
+def entry(topic, images, link_files, defs, string=None, use_date=None,
+          tags=None, fields=None):
+    """create an entry, with the images as figures and a download link
+    to each of the link_files.  Any tags and (name, value) fields are
+    added to the entry as a ReST field list (see meta_util)"""
 
     try:
         editor = os.environ["EDITOR"]
     except:
         editor = "emacs"
 
+    # check all of the files before we change anything
+    for im in images + link_files:
+        if not os.path.isfile(im):
+            sys.exit("ERROR: file {} does not exist".format(im))
+
     # determine the filename
     if use_date is not None:
         entry_dir = use_date
@@ -74,10 +207,7 @@ def entry(topic, images, link_file, defs, string=None, use_date=None):
     ofile = entry_dir + ".rst"
 
     # determine the directory we place it in -- this is the form yyyy-mm-dd/
-    odir = "{}/journal-{}/source/{}/{}/".format(defs["working_path"],
-                                                defs["nickname"],
-                                                topic,
-                                                entry_dir)
+    odir = get_entry_dir(topic, entry_dir, defs)
 
     if not os.path.isdir(odir):
         try:
@@ -88,8 +218,7 @@ def entry(topic, images, link_file, defs, string=None, use_date=None):
 
     entry_file = os.path.join(odir, ofile)
     if not os.path.isfile(entry_file):
-        header = len(entry_dir)*"=" + "\n" + "{}\n".format(entry_dir) + len(entry_dir)*"=" + "\n"
-        header += SYMBOLS + "\n\n"
+        header = get_header(entry_dir)
     else:
         header = ""
 
@@ -101,6 +230,15 @@ def entry(topic, images, link_file, defs, string=None, use_date=None):
         sys.exit("ERROR: unable to open {}".format(os.path.join(odir, ofile)))
 
     f.write(header)
+    if tags or fields:
+        import pyjournal2.meta_util as meta_util
+        ftext = meta_util.field_text(tags, fields)
+        if not header:
+            # the field list has to be a paragraph of its own, after
+            # the text already in the entry
+            ftext = paragraph_break(entry_file) + ftext
+        f.write(ftext)
+
     if string is not None:
         f.write(string)
 
@@ -108,49 +246,38 @@ def entry(topic, images, link_file, defs, string=None, use_date=None):
     # headings to the entry
     unique_id = get_unique_string()
 
-    files_copied = []
-    for im in images + [link_file]:
-
-        if im is None:
-            continue
-
-        # does an file by that name already live in the dest
-        # directory?
-        src = im
-        dest = odir
+    # web-sized versions of the images
+    thumbs = image_util.make_thumbnails(images, defs)
 
-        im_copy = os.path.basename(im)
-        if os.path.isfile("{}/{}".format(dest, im_copy)):
-            im_copy = "{}_{}".format(unique_id.replace(".", "_"), im_copy)
+    # name all of the files first, against everything that is or will
+    # be in the entry directory, then copy them all at once
+    taken = set(os.listdir(odir))
+    copies = []
 
-        dest = os.path.join(dest, im_copy)
+    for im in images + link_files:
 
-        # copy it
-        if im != "":
-            try:
-                shutil.copy(src, dest)
-            except:
-                sys.exit("ERROR: unable to copy image {} to {}".format(src, dest))
+        im_copy, new = copy_name(im, odir, taken, unique_id)
+        if new:
+            copies.append((im, os.path.join(odir, im_copy)))
 
-            files_copied.append(im_copy)
+        if im in images:
+            # put the thumbnail next to the image
+            thumb_copy = None
+            if im in thumbs:
+                thumb_copy = image_util.get_thumbnail_name(im_copy)
+                if thumb_copy not in taken:
+                    taken.add(thumb_copy)
+                    copies.append((thumbs[im], os.path.join(odir, thumb_copy)))
 
-            if im in images:
-                # create a unique label for latex referencing
-                idx = im_copy.lower().rfind(".jpg")
-                idx = max(idx, im_copy.lower().rfind(".png"))
-                idx = max(idx, im_copy.lower().rfind(".pdf"))
+            # add the figure text
+            f.write(figure_text(topic, entry_dir, im_copy, unique_id,
+                                thumb_copy=thumb_copy))
 
-                if idx >= 0:
-                    im0 = "{}:{}".format(unique_id, im_copy[:idx])
-
-                # add the figure text
-                for l in FIGURE_STR.split("\n"):
-                    f.write("{}\n".format(
-                        l.replace("@figname@", "/{}/{}/{}".format(topic, entry_dir, im_copy)).replace("@figlabel@", im0).rstrip()))
+        else:
+            # add the download directive
+            f.write(download_text(topic, entry_dir, im_copy))
 
-            else:
-                # add the download directive
-                f.write(":download:`{} </{}/{}/{}>`\n\n".format(im_copy, topic, entry_dir, im_copy))
+    files_copied = [os.path.basename(cfile) for cfile in copy_files(copies, defs)]
 
     f.close()
 
@@ -161,15 +288,45 @@ def entry(topic, images, link_file, defs, string=None, use_date=None):
         else:
             prog = "{} {}/{}".format(editor, odir, ofile)
 
-        stdout, stderr, rc = shell_util.run(prog)
+        stdout, stderr, rc = shell_util.run(prog, interactive=True)
+
+    # commit the entry and any images to the working git repo, all
+    # in a single commit
 
-    # commit the entry to the working git repo
-    os.chdir(odir)
+    message = "new entry: {}/{}".format(topic, entry_dir)
+    if files_copied:
+        message += "\n\nattachments:\n"
+        message += "".join("  {}\n".format(im) for im in files_copied)
+
+    stdout, stderr, rc = commit([ofile] + files_copied, message, cwd=odir)
+
+    # in auto-publish mode, push in the background, so we don't wait
+    # on the network
+    if rc == 0 and defs.get("auto_publish"):
+        import pyjournal2.publish_util as publish_util
+        publish_util.queue_push(defs, message)
+
+
+def commit(files, message, pathspec_file=None, cwd=None):
+    """stage and commit the files (relative to the directory cwd, or
+    the current directory) with a single git add and a single git
+    commit.  If pathspec_file is given, the list of files is passed to
+    git through that file instead of on the commandline, so there is
+    no limit on how many files we can commit at once"""
+
+    if pathspec_file is not None:
+        with open(pathspec_file, "w") as pf:
+            for f in files:
+                pf.write(f + "\n")
+        file_list = "--pathspec-from-file={}".format(shlex.quote(pathspec_file))
+    else:
+        file_list = "-- " + " ".join(shlex.quote(f) for f in files)
 
-    stdout, stderr, rc = shell_util.run("git add " + ofile)
-    stdout, stderr, rc = shell_util.run("git commit -m 'new entry' " + ofile)
+    # git allows only one add or commit at a time in a repo
+    with _commit_lock:
+        stdout, stderr, rc = shell_util.run("git add " + file_list, cwd=cwd)
+        if rc != 0:
+            return stdout, stderr, rc
 
-    # commit any images too
-    for im in files_copied:
-        stdout, stderr, rc = shell_util.run("git add " + im)
-        stdout, stderr, rc = shell_util.run("git commit -m 'new image' " + im)
+        return shell_util.run("git commit -m {} {}".format(shlex.quote(message),
+                                                          file_list), cwd=cwd)
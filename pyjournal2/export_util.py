@@ -0,0 +1,201 @@
+"""This module exports the journal to a single file: a JSON Lines file
+with one record per entry, a tar or zip archive of the entries and
+their attachments, or a LaTeX document / PDF made by Sphinx's LaTeX
+builder.
+
+The JSON Lines and archive exports go through the entries one at a
+time, in topic and date order, and copy the files into the output in
+chunks, so the memory used does not depend on the size of the
+journal.  The output can be stdout ("-"), so an export can be piped
+straight to another machine.
+
+"""
+
+import json
+import os
+import shutil
+import sys
+import tarfile
+import zipfile
+
+import pyjournal2.build_util as build_util
+import pyjournal2.index_util as index_util
+import pyjournal2.shell_util as shell_util
+
+FORMATS = ["jsonl", "tar", "tar.gz", "zip", "latex", "pdf"]
+
+# the format to use for an output filename extension
+EXTENSIONS = [(".jsonl", "jsonl"), (".tar.gz", "tar.gz"), (".tgz", "tar.gz"),
+              (".tar", "tar"), (".zip", "zip"), (".tex", "latex"),
+              (".pdf", "pdf")]
+
+
+def get_format(output, fmt=None):
+    """return the export format, from fmt if given, otherwise from the
+    extension of the output file"""
+
+    if fmt is not None:
+        return fmt
+
+    for ext, f in EXTENSIONS:
+        if output.endswith(ext):
+            return f
+
+    sys.exit("ERROR: unable to tell the export format from {}, use --format".format(output))
+
+
+def iter_entries(defs, topics=None):
+    """yield (topic, date, files) for each entry, in topic and date order,
+    where files is the list of files in the entry directory"""
+
+    all_topics = sorted(build_util.get_topics(defs))
+    if topics is not None:
+        all_topics = [t for t in all_topics if t in topics]
+
+    for topic in all_topics:
+        _, entries = build_util.get_topic_entries(topic, defs)
+        for e in entries:
+            yield topic, e, index_util.get_entry_files(topic, e, defs)
+
+
+def open_output(output, mode):
+    """open the output file (or stdout for "-") in binary mode"""
+
+    if output == "-":
+        return os.fdopen(os.dup(sys.stdout.fileno()), mode)
+
+    try:
+        return open(output, mode)
+    except OSError as e:
+        sys.exit("ERROR: unable to write {}: {}".format(output, e))
+
+
+def export_jsonl(out, defs, topics=None):
+    """write a JSON Lines record for each entry, with the entry text and
+    the name and size of each attachment"""
+
+    source_dir = build_util.get_source_dir(defs)
+    nentries = nfiles = 0
+
+    for topic, date, files in iter_entries(defs, topics):
+        edir = os.path.join(source_dir, topic, date)
+        rst = date + ".rst"
+
+        text = ""
+        if rst in files:
+            with open(os.path.join(edir, rst), "r", errors="replace") as f:
+                text = f.read()
+
+        attachments = []
+        for name in files:
+            if name == rst:
+                continue
+            attachments.append({"name": name,
+                                "size": os.path.getsize(os.path.join(edir, name))})
+
+        record = {"topic": topic, "date": date,
+                  "path": "{}/{}/{}".format(topic, date, rst),
+                  "text": text, "attachments": attachments}
+        out.write((json.dumps(record) + "\n").encode("utf-8"))
+
+        nentries += 1
+        nfiles += len(attachments)
+
+    return nentries, nfiles
+
+
+def export_archive(out, fmt, defs, topics=None):
+    """write the entries, with their attachments, into a tar or zip
+    archive, laid out as journal-nickname/topic/YYYY-MM-DD/files"""
+
+    source_dir = build_util.get_source_dir(defs)
+    root = "journal-{}".format(defs["nickname"])
+    nentries = nfiles = 0
+
+    if fmt == "zip":
+        archive = zipfile.ZipFile(out, "w", compression=zipfile.ZIP_DEFLATED)
+        add = archive.write
+    else:
+        # the "|" modes write a stream, without seeking back
+        archive = tarfile.open(fileobj=out, mode="w|gz" if fmt == "tar.gz" else "w|")
+        add = archive.add
+
+    with archive:
+        for topic, date, files in iter_entries(defs, topics):
+            for name in files:
+                add(os.path.join(source_dir, topic, date, name),
+                    "/".join([root, topic, date, name]))
+            nentries += 1
+
+            # count the attachments, like export_jsonl()
+            nfiles += len([name for name in files if name != date + ".rst"])
+
+    return nentries, nfiles
+
+
+def export_latex(output, pdf, defs, jobs=None):
+    """build the journal with Sphinx's LaTeX builder and copy the result
+    (the LaTeX directory, or the PDF) to output"""
+
+    build_util.write_tocs(defs)
+
+    journal_dir = index_util.get_journal_dir(defs)
+
+    target = "latexpdf" if pdf else "latex"
+    jobs = build_util.get_jobs(defs, jobs)
+    _, _, rc = shell_util.run("make {} SPHINXOPTS='-j {}'".format(target, jobs),
+                              line_callback=build_util.show_progress, cwd=journal_dir)
+    build_util.show_progress(None)
+    if rc != 0:
+        sys.exit("ERROR: the Sphinx {} build failed".format(target))
+
+    latex_dir = os.path.join(journal_dir, "build", "latex")
+
+    if not os.path.isdir(latex_dir):
+        sys.exit("ERROR: the Sphinx {} build did not make {}".format(target, latex_dir))
+
+    if pdf:
+        pdfs = [f for f in os.listdir(latex_dir) if f.endswith(".pdf")]
+        if not pdfs:
+            sys.exit("ERROR: no PDF was made in {}".format(latex_dir))
+        shutil.copyfile(os.path.join(latex_dir, pdfs[0]), output)
+    else:
+        if os.path.exists(output):
+            sys.exit("ERROR: {} already exists".format(output))
+        shutil.copytree(latex_dir, output)
+
+
+def export(output, defs, fmt=None, topics=None):
+    """export the journal (or just the given topics) to output"""
+
+    fmt = get_format(output, fmt)
+
+    if topics is not None:
+        for t in topics:
+            if t not in build_util.get_topics(defs):
+                sys.exit("ERROR: topic {} does not exist".format(t))
+
+    # a relative output is relative to where we were run
+    if output != "-":
+        output = os.path.abspath(output)
+
+    if fmt in ["latex", "pdf"]:
+        if output == "-":
+            sys.exit("ERROR: the {} export can't be written to stdout".format(fmt))
+        if topics is not None:
+            sys.exit("ERROR: the {} export is always of the whole journal".format(fmt))
+        export_latex(output, fmt == "pdf", defs)
+        summary = "exported the journal to {}".format(output)
+
+    else:
+        with open_output(output, "wb") as out:
+            if fmt == "jsonl":
+                nentries, nfiles = export_jsonl(out, defs, topics)
+            else:
+                nentries, nfiles = export_archive(out, fmt, defs, topics)
+
+        summary = "exported {} entries with {} attachments to {}".format(
+            nentries, nfiles, "stdout" if output == "-" else output)
+
+    # keep stdout clean when the export is written there
+    print(summary, file=sys.stderr if output == "-" else sys.stdout)
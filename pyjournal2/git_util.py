@@ -2,10 +2,12 @@
 
 import os
 import re
+import shlex
 import sys
 import shutil
 
 import pyjournal2.entry_util as entry_util
+import pyjournal2.main_util as main_util
 import pyjournal2.shell_util as shell_util
 
 #=============================================================================
@@ -16,6 +18,10 @@ def init(nickname, username, master_path, working_path, defs):
     """initialize the journal by setting up the git repo and copying the
     basic sphinx directory tree"""
 
+    # make sure we don't already have a journal by that name
+    if nickname in defs.get("journals", []):
+        sys.exit("ERROR: a journal named {} already exists".format(nickname))
+
     # make sure we have absolute paths
     working_path = os.path.abspath(working_path)
 
@@ -36,16 +42,13 @@ def init(nickname, username, master_path, working_path, defs):
     except:
         sys.exit("ERROR: unable to create a directory in {}".format(master_path))
 
-    os.chdir(git_master)
-    shell_util.run("git init --bare")
+    shell_util.run("git init --bare", cwd=git_master)
 
     # create the local working copy
-    try:
-        os.chdir(working_path)
-    except:
+    if not os.path.isdir(working_path):
         sys.exit("ERROR: unable to change to {}".format(working_path))
 
-    shell_util.run("git clone " + git_master)
+    shell_util.run("git clone " + git_master, cwd=working_path)
 
     # create the initial directory structure
     working_journal = "{}/journal-{}".format(working_path, nickname)
@@ -64,33 +67,25 @@ def init(nickname, username, master_path, working_path, defs):
     #except:
     #    sys.exit("ERROR unable to write in initial directory structure")
 
-    # create the .pyjournal2rc file
-    try:
-        with open(defs["param_file"], "w") as f:
-            f.write("[{}]\n".format("main"))
-            f.write("master_repo = {}\n".format(git_master))
-            f.write("working_path = {}\n".format(working_path))
-            f.write("nickname = {}\n".format(nickname))
-            f.write("username = {}\n".format(username))
-    except:
-        sys.exit("ERROR: unable to open {} for appending".format(defs["param_file"]))
+    # add the journal to the .pyjournal2rc file
+    main_util.add_journal(defs["param_file"], nickname, git_master, working_path,
+                          username=username)
 
+    # the settings of any other journal don't apply to this one
+    defs.pop("remotes", None)
+    defs["journal"] = nickname
     defs["master_repo"] = git_master
     defs["working_path"] = working_path
     defs["nickname"] = nickname
     defs["username"] = username
 
     # create an initial entry saying "journal created"
-    images = []
-    link_file = ""
-    entry_util.entry("main", images, link_file, defs, string="journal created\n")
+    entry_util.entry("main", [], [], defs, string="journal created\n")
 
     # do a git add / push
-    os.chdir(working_journal)
-
-    shell_util.run("git add .")
-    shell_util.run("git commit -m 'initial journal.tex file' .")
-    shell_util.run("git push origin master")
+    shell_util.run("git add .", cwd=working_journal)
+    shell_util.run("git commit -m 'initial journal.tex file' .", cwd=working_journal)
+    shell_util.run("git push origin master", cwd=working_journal)
 
 def connect(master_repo, working_path, defs):
     """connect to an existing journal on git on another machine"""
@@ -104,47 +99,54 @@ def connect(master_repo, working_path, defs):
     else:
         sys.exit("ERROR: the remote-git-repo should be of the form: machine:/dir/journal-nickname.git")
 
-    # make sure that a journal does not already exist
-    if os.path.isfile(defs["param_file"]):
-        sys.exit("ERROR: a journal already exists")
+    # make sure that we don't already have a journal by that name
+    if nickname in defs.get("journals", []):
+        sys.exit("ERROR: a journal named {} already exists".format(nickname))
 
     # git clone the bare repo at master_repo into the working path
-    try:
-        os.chdir(working_path)
-    except:
+    if not os.path.isdir(working_path):
         sys.exit("ERROR: unable to switch to directory {}".format(working_path))
 
-    _, stderr, rc = shell_util.run("git clone " + master_repo)
+    _, stderr, rc = shell_util.run("git clone " + master_repo, cwd=working_path)
     if rc != 0:
         print(stderr)
         sys.exit("ERROR: something went wrong with the git clone")
 
-    # create (or add to) the .pyjournalrc file
-    try:
-        with open(defs["param_file"], "w") as f:
-            f.write("[{}]\n".format("main"))
-            f.write("master_repo = {}\n".format(master_repo))
-            f.write("working_path = {}\n".format(working_path))
-            f.write("nickname = {}\n".format(nickname))
-    except:
-        sys.exit("ERROR: unable to open {} for appending".format(defs["param_file"]))
+    # create (or add to) the .pyjournal2rc file
+    main_util.add_journal(defs["param_file"], nickname, master_repo,
+                          os.path.abspath(working_path))
 
 
 #=============================================================================
 # general routines
 #=============================================================================
 
-def pull(defs, nickname=None):
-    """pull the journal from the origin"""
+def get_working_dir(defs):
+    """return the working journal directory (the clone of the master
+    repo), which the git commands run in"""
 
     wd = "{}/journal-{}".format(defs["working_path"], defs["nickname"])
+    if not os.path.isdir(wd):
+        sys.exit("ERROR: the working directory {} does not exist".format(wd))
+    return wd
 
-    try:
-        os.chdir(wd)
-    except:
-        sys.exit("ERROR: unable to switch to working directory: {}".format(wd))
 
-    stdout, stderr, rc = shell_util.run("git pull")
+def get_remotes(defs):
+    """return a dictionary of the remotes the journal is synced with:
+    the master repo (as "origin") and any in the [remotes] section of
+    the .pyjournal2rc"""
+
+    remotes = {"origin": defs["master_repo"]}
+    remotes.update(defs.get("remotes", {}))
+    return remotes
+
+
+def pull(defs, nickname=None):
+    """pull the journal from the origin"""
+
+    wd = get_working_dir(defs)
+
+    stdout, stderr, rc = shell_util.run("git pull", cwd=wd)
     if rc != 0:
         print(stdout, stderr)
         sys.exit("ERROR: something went wrong with the git pull")
@@ -155,17 +157,109 @@ def pull(defs, nickname=None):
 def push(defs, nickname=None):
     """push the journal to the origin"""
 
-    # switch to the working directory and push to the master
-    wd = "{}/journal-{}".format(defs["working_path"], defs["nickname"])
+    # push from the working directory to the master
+    wd = get_working_dir(defs)
 
-    try:
-        os.chdir(wd)
-    except:
-        sys.exit("ERROR: unable to switch to working directory: {}".format(wd))
-
-    _, stderr, rc = shell_util.run("git push")
+    _, stderr, rc = shell_util.run("git push", cwd=wd)
     if rc != 0:
         print(stderr)
         sys.exit("ERROR: something went wrong with the git push")
 
     print(stderr)
+
+    # anything waiting to be pushed in the background went out too
+    import pyjournal2.publish_util as publish_util
+    publish_util.clear(defs)
+
+
+def get_branch(wd):
+    """return the name of the branch checked out in the working directory wd"""
+
+    stdout, _, rc = shell_util.run("git rev-parse --abbrev-ref HEAD", cwd=wd)
+    if rc != 0:
+        return "master"
+    return stdout.strip()
+
+
+def sync(defs, timeout=None):
+    """sync the journal with all of the remotes: fetch from all of them
+    concurrently, merge what we fetched (one remote at a time), and
+    then push to all of them concurrently.  Each git command against
+    a remote is given at most timeout seconds.  A table of the status
+    for each remote is printed at the end."""
+
+    wd = get_working_dir(defs)
+
+    if timeout is None:
+        timeout = defs.get("sync_timeout", 60)
+
+    remotes = get_remotes(defs)
+    branch = get_branch(wd)
+
+    status = {name: {"fetch": "-", "merge": "-", "push": "-", "time": 0.0,
+                     "error": ""} for name in remotes}
+
+    def remote_commands(cmds):
+        """run the commands (a dictionary of remote name: command) on the
+        remotes concurrently, returning the stderr and return code of
+        each"""
+        names = list(cmds)
+        with shell_util.timing() as records:
+            results = shell_util.run_many([cmds[name] for name in names],
+                                          timeout=timeout, cwd=wd)
+        times = {cmd: dt for cmd, dt, _ in records}
+        for name in names:
+            status[name]["time"] += times[cmds[name]]
+        return {name: (stderr, rc) for name, (_, stderr, rc) in zip(names, results)}
+
+    # each remote gets its own ref, so the fetches don't interfere
+    fetches = remote_commands({name: "git fetch --no-write-fetch-head {} +{}:refs/pyjournal2/{}".format(
+        shlex.quote(remotes[name]), branch, name) for name in remotes})
+
+    for name, (stderr, rc) in fetches.items():
+        if rc == 0:
+            status[name]["fetch"] = "ok"
+        elif "couldn't find remote ref" in stderr:
+            # an empty (new) remote -- there is nothing to merge
+            status[name]["fetch"] = "empty"
+        else:
+            status[name]["fetch"] = "failed"
+            status[name]["error"] = stderr.strip().split("\n")[0]
+
+    # merging changes the working tree, so this is done serially
+    for name in remotes:
+        if status[name]["fetch"] != "ok":
+            continue
+
+        _, stderr, rc = shell_util.run("git merge --no-edit refs/pyjournal2/{}".format(name), cwd=wd)
+        if rc == 0:
+            status[name]["merge"] = "ok"
+        else:
+            shell_util.run("git merge --abort", cwd=wd)
+            status[name]["merge"] = "failed"
+            status[name]["error"] = "merge conflict, resolve it by hand"
+
+    pushes = remote_commands({name: "git push {} HEAD:{}".format(shlex.quote(remotes[name]), branch)
+                              for name in remotes
+                              if status[name]["fetch"] != "failed" and
+                              status[name]["merge"] != "failed"})
+
+    for name, (stderr, rc) in pushes.items():
+        if rc == 0:
+            status[name]["push"] = "ok"
+        else:
+            status[name]["push"] = "failed"
+            status[name]["error"] = stderr.strip().split("\n")[0]
+
+    if status["origin"]["push"] == "ok":
+        import pyjournal2.publish_util as publish_util
+        publish_util.clear(defs)
+
+    print("{:12s} {:8s} {:8s} {:8s} {:>8s}".format("remote", "fetch", "merge", "push", "time (s)"))
+    for name in remotes:
+        st = status[name]
+        print("{:12s} {:8s} {:8s} {:8s} {:8.2f}  {}".format(name, st["fetch"], st["merge"],
+                                                            st["push"], st["time"], st["error"]))
+
+    if any(st["error"] for st in status.values()):
+        sys.exit("ERROR: unable to sync with all of the remotes")
@@ -0,0 +1,143 @@
+"""This module makes web-sized versions of the images added to the
+journal, so the pages don't need to load the full-size figures.
+
+The thumbnails are made with Pillow (an optional dependency -- without
+it, the full-size images are used).  They are cached by the
+content hash of the original, in the working journal's .git/
+directory, and many images are processed in parallel.
+
+"""
+
+import importlib.util
+import os
+import threading
+
+import pyjournal2.index_util as index_util
+import pyjournal2.store_util as store_util
+
+# the default size (in pixels) of the longest side of a thumbnail
+THUMBNAIL_SIZE = 1200
+
+# the formats we can make thumbnails of, and the extension we use for
+# the thumbnail
+THUMBNAIL_FORMATS = {".png": ".png", ".jpg": ".jpg", ".jpeg": ".jpg"}
+
+
+def get_thumbnail_size(defs):
+    """return the size of the thumbnails (the thumbnail_size option in
+    the .pyjournal2rc), or 0 if we are not making thumbnails"""
+
+    size = defs.get("thumbnail_size", None)
+
+    # Pillow is only imported where we need it, since importing it is
+    # slow compared to making an entry
+    if importlib.util.find_spec("PIL") is None:
+        if size:
+            print("WARNING: thumbnail_size is set but Pillow is not installed, using full-size images")
+        return 0
+
+    if size is None:
+        size = THUMBNAIL_SIZE
+
+    return max(0, int(size))
+
+
+def get_thumbnail_name(im_copy):
+    """return the name of the thumbnail for image im_copy (in the entry
+    directory), or None if we can't make a thumbnail of it"""
+
+    base, ext = os.path.splitext(im_copy)
+    text = THUMBNAIL_FORMATS.get(ext.lower())
+    if text is None:
+        return None
+    return "{}.thumb{}".format(base, text)
+
+
+def _make_thumbnail(src, dest, size):
+    """write a thumbnail of src, with a longest side of size pixels, to
+    dest.  Return False if src is already small enough to not need
+    one, or None if we could not read it."""
+
+    from PIL import Image
+
+    tmp = "{}.{}.{}.tmp".format(dest, os.getpid(), threading.get_ident())
+
+    try:
+        with Image.open(src) as im:
+            if max(im.size) <= size:
+                return False
+
+            im.thumbnail((size, size))
+
+            # JPEGs are saved as progressive JPEGs, so they display
+            # while they load
+            if dest.endswith(".jpg"):
+                if im.mode not in ("RGB", "L"):
+                    im = im.convert("RGB")
+                im.save(tmp, "JPEG", quality=85, optimize=True, progressive=True)
+            else:
+                im.save(tmp, "PNG", optimize=True)
+    except OSError:
+        return None
+
+    os.replace(tmp, dest)
+    return True
+
+
+def make_thumbnails(images, defs, max_workers=None):
+    """make (or find in the cache) the thumbnails for the list of
+    images.  Return a dictionary mapping each image that has a
+    thumbnail to the cached thumbnail file."""
+
+    if not images:
+        return {}
+
+    size = get_thumbnail_size(defs)
+    if size == 0:
+        return {}
+
+    cache_dir = os.path.join(index_util.get_state_dir(defs), "thumbs")
+    os.makedirs(cache_dir, exist_ok=True)
+
+    thumbs = {}
+    todo = []
+    for im in images:
+        name = get_thumbnail_name(os.path.basename(im))
+        if name is None:
+            continue
+
+        ext = os.path.splitext(name)[1]
+        digest = store_util.file_hash(im)
+        thumb = os.path.join(cache_dir, "{}-{}{}".format(digest, size, ext))
+
+        # a cached file with no content marks an image that is already
+        # small enough
+        nothumb = thumb + ".none"
+
+        if os.path.isfile(thumb):
+            thumbs[im] = thumb
+        elif not os.path.isfile(nothumb):
+            todo.append((im, thumb, nothumb))
+
+    def record(job, made):
+        im, thumb, nothumb = job
+        if made:
+            thumbs[im] = thumb
+        elif made is not None:
+            open(nothumb, "w").close()
+
+    if len(todo) == 1:
+        job = todo[0]
+        record(job, _make_thumbnail(job[0], job[1], size))
+
+    elif todo:
+        # images are decoded and resized in separate processes
+        import concurrent.futures
+
+        with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as pool:
+            made = pool.map(_make_thumbnail, [j[0] for j in todo],
+                            [j[1] for j in todo], [size]*len(todo))
+            for job, m in zip(todo, made):
+                record(job, m)
+
+    return thumbs
@@ -0,0 +1,220 @@
+"""This module imports many entries (and their figures and files) into
+the journal at once, without an editor, and commits them together"""
+
+import datetime
+import json
+import os
+import re
+import sys
+
+import pyjournal2.build_util as build_util
+import pyjournal2.entry_util as entry_util
+import pyjournal2.image_util as image_util
+import pyjournal2.index_util as index_util
+
+# files with these extensions become figures, anything else becomes a
+# download link
+IMAGE_EXTENSIONS = [".png", ".jpg", ".jpeg", ".gif", ".svg", ".pdf"]
+
+# files with these extensions are text that is added to the entry
+TEXT_EXTENSIONS = [".rst", ".txt"]
+
+
+def read_manifest(manifest):
+    """read a JSON manifest.  This is a list of objects of the form
+
+    {"topic": "sims", "date": "YYYY-MM-DD", "text": "...",
+     "images": ["plot.png", ...], "links": ["data.h5", ...]}
+
+    where everything but the topic and date is optional and relative
+    paths are relative to the manifest.  Return a list of items of the
+    form (topic, date, text, images, links)"""
+
+    try:
+        with open(manifest, "r") as f:
+            records = json.load(f)
+    except (OSError, ValueError) as e:
+        sys.exit("ERROR: unable to read manifest {}: {}".format(manifest, e))
+
+    base = os.path.dirname(os.path.abspath(manifest))
+
+    items = []
+    for r in records:
+        try:
+            topic = r["topic"]
+            date = r["date"]
+        except (KeyError, TypeError):
+            sys.exit("ERROR: each manifest record needs a topic and a date")
+
+        images = [os.path.join(base, im) for im in r.get("images", [])]
+        links = [os.path.join(base, l) for l in r.get("links", [])]
+        items.append((topic, date, r.get("text", ""), images, links))
+
+    return items
+
+
+def read_tree(root):
+    """read a directory tree of the form root/topic/YYYY-MM-DD/files.
+    Text files are added to the entry, images become figures and all
+    other files are linked.  Return a list of items of the form
+    (topic, date, text, images, links)"""
+
+    items = []
+    for topic in sorted(os.listdir(root)):
+        tdir = os.path.join(root, topic)
+        if not os.path.isdir(tdir) or topic.startswith(("_", ".")):
+            continue
+
+        for date in sorted(os.listdir(tdir)):
+            ddir = os.path.join(tdir, date)
+            if not os.path.isdir(ddir):
+                continue
+
+            text = ""
+            images = []
+            links = []
+            for f in sorted(os.listdir(ddir)):
+                src = os.path.join(ddir, f)
+                if not os.path.isfile(src):
+                    continue
+
+                ext = os.path.splitext(f)[1].lower()
+                if ext in TEXT_EXTENSIONS:
+                    with open(src, "r") as tf:
+                        text += tf.read().rstrip("\n") + "\n\n"
+                elif ext in IMAGE_EXTENSIONS:
+                    images.append(src)
+                else:
+                    links.append(src)
+
+            items.append((topic, date, text, images, links))
+
+    return items
+
+
+def import_entries(source, defs, max_workers=None):
+    """import the entries described by source -- either a JSON manifest
+    or a directory tree (see read_manifest() and read_tree()).  All
+    of the entries are created (or appended to), the files are copied
+    concurrently, and everything is added to the journal in a single
+    commit"""
+
+    if os.path.isdir(source):
+        items = read_tree(source)
+    else:
+        items = read_manifest(source)
+
+    if not items:
+        sys.exit("ERROR: nothing to import from {}".format(source))
+
+    # check everything first, so we don't leave a half-finished import
+    for topic, date, _, images, links in items:
+        # fromisoformat also takes forms like YYYYMMDD and week dates,
+        # but the entry directories must be YYYY-MM-DD
+        try:
+            if not re.fullmatch(r"[0-9]{4}-[0-9]{2}-[0-9]{2}", date):
+                raise ValueError
+            datetime.date.fromisoformat(date)
+        except (TypeError, ValueError):
+            sys.exit("ERROR: invalid date {} for topic {}, should be YYYY-MM-DD".format(date, topic))
+
+        if not topic or topic.startswith(("_", ".")) or "/" in topic:
+            sys.exit("ERROR: invalid topic name {}".format(topic))
+
+        for im in images + links:
+            if not os.path.isfile(im):
+                sys.exit("ERROR: file {} does not exist".format(im))
+
+    topics = build_util.get_topics(defs)
+    unique_id = entry_util.get_unique_string()
+
+    journal_dir = index_util.get_journal_dir(defs)
+
+    # web-sized versions of all of the images, made in parallel
+    thumbs = image_util.make_thumbnails([im for item in items for im in item[3]],
+                                        defs, max_workers=max_workers)
+
+    copies = []
+    new_files = []
+    nentries = 0
+
+    # the files copied from the source (not counting the thumbnails)
+    nfiles = 0
+
+    # group the items by entry, so that each entry file is only opened once
+    entries = {}
+    for topic, date, text, images, links in items:
+        entries.setdefault((topic, date), []).append((text, images, links))
+
+    for (topic, date), parts in sorted(entries.items()):
+
+        if topic not in topics:
+            build_util.create_topic(topic, defs)
+            topics.append(topic)
+
+        odir = entry_util.get_entry_dir(topic, date, defs)
+        if not os.path.isdir(odir):
+            os.mkdir(odir)
+
+        ofile = os.path.join(odir, date + ".rst")
+        if os.path.isfile(ofile):
+            etext = "\n"
+        else:
+            etext = entry_util.get_header(date)
+
+        # the files that are or will be in this entry directory, to
+        # detect name collisions without copying anything yet
+        taken = set(os.listdir(odir))
+
+        for text, images, links in parts:
+            if text:
+                etext += text.rstrip("\n") + "\n\n"
+
+            for im in images + links:
+                # if an identical file is already in the entry
+                # directory, we just refer to it
+                im_copy, new = entry_util.copy_name(im, odir, taken, unique_id)
+                if new:
+                    copies.append((im, os.path.join(odir, im_copy)))
+                    nfiles += 1
+
+                if im in images:
+                    thumb_copy = None
+                    if im in thumbs:
+                        thumb_copy = image_util.get_thumbnail_name(im_copy)
+                        if thumb_copy not in taken:
+                            taken.add(thumb_copy)
+                            copies.append((thumbs[im], os.path.join(odir, thumb_copy)))
+
+                    label = "{}:{}:{}".format(unique_id, topic, date)
+                    etext += entry_util.figure_text(topic, date, im_copy, label,
+                                                    thumb_copy=thumb_copy)
+                else:
+                    etext += entry_util.download_text(topic, date, im_copy)
+
+        with open(ofile, "a") as f:
+            f.write(etext)
+
+        new_files.append(os.path.join("source", topic, date, date + ".rst"))
+        nentries += 1
+
+    # large files are committed as their pointer files
+    for cfile in entry_util.copy_files(copies, defs, max_workers=max_workers):
+        new_files.append(os.path.relpath(cfile, journal_dir))
+
+    # commit everything at once
+
+    message = "import: {} entries, {} files from {}".format(nentries, nfiles,
+                                                           os.path.basename(os.path.normpath(source)))
+    pathspec_file = os.path.join(index_util.get_state_dir(defs), "import-pathspec")
+    _, stderr, rc = entry_util.commit(new_files, message, pathspec_file=pathspec_file,
+                                      cwd=journal_dir)
+    if rc != 0:
+        print(stderr)
+        sys.exit("ERROR: unable to commit the imported entries")
+
+    if defs.get("auto_publish"):
+        import pyjournal2.publish_util as publish_util
+        publish_util.queue_push(defs, message)
+
+    entry_util.success("imported {} entries with {} files".format(nentries, nfiles))
@@ -0,0 +1,250 @@
+"""This module maintains a persistent index of the topics, entries and
+attached files in the journal, so we don't need to list the whole
+source tree each time we need to know what is in it.
+
+The index is stored as JSON in the working journal's .git/ directory
+(so it is never committed) and each directory in it is keyed by its
+mtime -- a directory is only listed again if its mtime changed.
+
+The index of each journal is guarded by a lock, so several threads can
+use the same journal (or different journals) at once.
+
+"""
+
+import json
+import os
+import threading
+import time
+
+INDEX_VERSION = 1
+
+# a directory whose mtime is this close (in ns) to the time we list it
+# could still change within the same mtime tick, so we don't trust it
+RACY_NS = 2*10**9
+
+# indices we've already loaded in this process, keyed by index file
+_indices = {}
+
+# a lock for each index file, and one guarding the creation of those
+_locks = {}
+_locks_lock = threading.Lock()
+
+
+def get_journal_dir(defs):
+    """return the working journal directory (the git clone)"""
+    return "{}/journal-{}/".format(defs["working_path"], defs["nickname"])
+
+
+def get_state_dir(defs):
+    """return the directory where we keep local, uncommitted state (like
+    the index) for the journal"""
+    sdir = os.path.join(get_journal_dir(defs), ".git", "pyjournal2")
+    # several threads may get here at once.  (This is not makedirs,
+    # so a missing working journal is still an error.)
+    try:
+        os.mkdir(sdir)
+    except FileExistsError:
+        pass
+    return sdir
+
+
+def get_index_file(defs):
+    """return the name of the file the index is stored in"""
+    return os.path.join(get_state_dir(defs), "index.json")
+
+
+def _mtime(path):
+    """return the mtime (ns) of path, or None if it is so recent that it
+    may still change without the mtime changing"""
+
+    mt = os.stat(path).st_mtime_ns
+    if time.time_ns() - mt < RACY_NS:
+        return None
+    return mt
+
+
+def _list_dirs(path):
+    """return the subdirectories of path"""
+    return [d.name for d in os.scandir(path) if d.is_dir()]
+
+
+def get_lock(defs):
+    """return the lock guarding the index of the journal"""
+
+    index_file = get_index_file(defs)
+    with _locks_lock:
+        if index_file not in _locks:
+            _locks[index_file] = threading.RLock()
+        return _locks[index_file]
+
+
+def load(defs):
+    """return the index for the journal, reading it from disk the first
+    time we are called"""
+
+    index_file = get_index_file(defs)
+
+    if index_file in _indices:
+        return _indices[index_file]
+
+    index = None
+    if os.path.isfile(index_file):
+        try:
+            with open(index_file, "r") as f:
+                index = json.load(f)
+        except ValueError:
+            index = None
+
+    if index is None or index.get("version") != INDEX_VERSION:
+        index = {"version": INDEX_VERSION, "mtime": None, "topics": {}}
+
+    index["_dirty"] = False
+    _indices[index_file] = index
+    return index
+
+
+def save(defs):
+    """write the index back to disk, if it changed"""
+
+    index_file = get_index_file(defs)
+    index = _indices.get(index_file)
+    if index is None or not index["_dirty"]:
+        return
+
+    data = {k: v for k, v in index.items() if k != "_dirty"}
+
+    # write to a temporary file and move it into place, so a reader
+    # never sees a partially written index
+    tmp_file = "{}.{}.tmp".format(index_file, os.getpid())
+    with open(tmp_file, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp_file, index_file)
+
+    index["_dirty"] = False
+
+
+def _refresh_topics(defs, index):
+    """update the list of topics if the source directory changed"""
+
+    source_dir = os.path.join(get_journal_dir(defs), "source")
+
+    mt = _mtime(source_dir)
+    if mt is not None and mt == index["mtime"]:
+        return
+
+    topics = [d for d in _list_dirs(source_dir) if not d.startswith("_")]
+
+    for t in list(index["topics"]):
+        if t not in topics:
+            del index["topics"][t]
+
+    for t in topics:
+        if t not in index["topics"]:
+            index["topics"][t] = {"mtime": None, "entries": {}}
+
+    index["mtime"] = mt
+    index["_dirty"] = True
+
+
+def _refresh_entries(topic, defs, index):
+    """update the list of entries in topic if its directory changed"""
+
+    tinfo = index["topics"].setdefault(topic, {"mtime": None, "entries": {}})
+
+    tdir = os.path.join(get_journal_dir(defs), "source", topic)
+
+    mt = _mtime(tdir)
+    if mt is not None and mt == tinfo["mtime"]:
+        return
+
+    # entry directories are in the form YYYY-MM-DD
+    entries = _list_dirs(tdir)
+
+    for e in list(tinfo["entries"]):
+        if e not in entries:
+            del tinfo["entries"][e]
+
+    for e in entries:
+        if e not in tinfo["entries"]:
+            tinfo["entries"][e] = {"mtime": None, "files": []}
+
+    tinfo["mtime"] = mt
+    index["_dirty"] = True
+
+
+def get_topics(defs):
+    """return a list of the currently known topics"""
+
+    with get_lock(defs):
+        index = load(defs)
+        _refresh_topics(defs, index)
+        save(defs)
+
+        return list(index["topics"])
+
+
+def get_topic_entries(topic, defs):
+    """return the sorted list of years and entries (YYYY-MM-DD) for the
+    topic"""
+
+    with get_lock(defs):
+        index = load(defs)
+        _refresh_entries(topic, defs, index)
+        save(defs)
+
+        entries = sorted(index["topics"][topic]["entries"])
+    years = sorted({e.split("-")[0] for e in entries})
+
+    return years, entries
+
+
+def get_entry_files(topic, entry, defs):
+    """return the sorted list of files (the entry .rst and any
+    attachments) in the directory of the given entry"""
+
+    with get_lock(defs):
+        index = load(defs)
+        _refresh_entries(topic, defs, index)
+
+        einfo = index["topics"][topic]["entries"][entry]
+
+        edir = os.path.join(get_journal_dir(defs), "source", topic, entry)
+        mt = _mtime(edir)
+        if mt is None or mt != einfo["mtime"]:
+            einfo["files"] = sorted(f.name for f in os.scandir(edir) if f.is_file())
+            einfo["mtime"] = mt
+            index["_dirty"] = True
+
+        save(defs)
+
+        return list(einfo["files"])
+
+
+def changed_entries(defs, known):
+    """compare the entry files with known, a dictionary of path: (mtime,
+    size) from an earlier scan, with the paths relative to the source
+    directory (topic/YYYY-MM-DD/YYYY-MM-DD.rst).  Return a list of
+    (path, topic, date, mtime, size) for the entries that are new or
+    changed, and a list of the paths of the entries that are gone.
+    This is used to keep the search and metadata databases up to
+    date."""
+
+    source_dir = os.path.join(get_journal_dir(defs), "source")
+
+    changed = []
+    seen = set()
+
+    for topic in get_topics(defs):
+        _, entries = get_topic_entries(topic, defs)
+        for e in entries:
+            path = "{}/{}/{}.rst".format(topic, e, e)
+            try:
+                st = os.stat(os.path.join(source_dir, path))
+            except OSError:
+                continue
+
+            seen.add(path)
+            if known.get(path) != (st.st_mtime_ns, st.st_size):
+                changed.append((path, topic, e, st.st_mtime_ns, st.st_size))
+
+    return changed, sorted(set(known) - seen)
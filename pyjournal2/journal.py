@@ -0,0 +1,150 @@
+"""This module provides a Journal object, for using pyjournal2 as a
+library.  A Journal holds the configuration of one journal and all of
+its operations work on absolute paths (nothing changes the current
+directory), so a program can hold several journals and work on them
+from different threads at once, e.g.:
+
+    import concurrent.futures
+    from pyjournal2.journal import Journal
+
+    journals = [Journal.from_config(), Journal("/data/work", "thesis")]
+    with concurrent.futures.ThreadPoolExecutor() as pool:
+        list(pool.map(Journal.write_tocs, journals))
+
+Like the commandline tool, the operations print their progress and
+report errors with sys.exit(), which raises SystemExit.
+
+"""
+
+import os
+
+import pyjournal2.build_util as build_util
+import pyjournal2.index_util as index_util
+
+
+class Journal:
+    """a journal: the working clone in working_path/journal-nickname/
+    (and optionally its master repo).  Any other options (jobs,
+    layout, attachment_store, ...) are the same as the settings in the
+    .pyjournal2rc."""
+
+    def __init__(self, working_path, nickname, master_repo=None, **options):
+        self.defs = dict(options)
+        self.defs["working_path"] = os.path.abspath(working_path)
+        self.defs["nickname"] = nickname
+        self.defs["module_dir"] = os.path.dirname(os.path.abspath(__file__))
+        if master_repo is not None:
+            self.defs["master_repo"] = master_repo
+
+    @classmethod
+    def from_config(cls, param_file=None, name=None):
+        """return the journal called name (by default, the default
+        journal) set up in a .pyjournal2rc (by default, the one in the
+        home directory)"""
+
+        import pyjournal2.main_util as main_util
+        defs = main_util.read_config(param_file, journal=name)
+        if "nickname" not in defs:
+            raise ValueError("no journal is set up in {}".format(defs["param_file"]))
+
+        journal = cls(defs["working_path"], defs["nickname"])
+        journal.defs.update(defs)
+        return journal
+
+    def __repr__(self):
+        return "Journal({!r}, {!r})".format(self.defs["working_path"], self.defs["nickname"])
+
+    @property
+    def journal_dir(self):
+        """the working journal directory (the git clone)"""
+        return index_util.get_journal_dir(self.defs)
+
+    @property
+    def source_dir(self):
+        """the Sphinx source directory, with a directory for each topic"""
+        return build_util.get_source_dir(self.defs)
+
+    # the contents
+
+    def topics(self):
+        """return the sorted list of topics"""
+        return sorted(build_util.get_topics(self.defs))
+
+    def entries(self, topic):
+        """return the sorted list of entries (YYYY-MM-DD) in a topic"""
+        _, entries = build_util.get_topic_entries(topic, self.defs)
+        return entries
+
+    def entry_files(self, topic, entry):
+        """return the files (the .rst and the attachments) of an entry"""
+        return index_util.get_entry_files(topic, entry, self.defs)
+
+    def create_topic(self, topic):
+        """create a new (empty) topic"""
+        build_util.create_topic(topic, self.defs)
+
+    def add_entry(self, topic, text, images=None, links=None, date=None,
+                  tags=None, fields=None):
+        """add text (and any images and linked files) to the entry of
+        the topic for date (default: today) and commit it.  fields is a
+        list of (name, value) metadata fields."""
+
+        import pyjournal2.entry_util as entry_util
+        entry_util.entry(topic, list(images or []), list(links or []), self.defs,
+                         string=text, use_date=date, tags=tags, fields=fields)
+
+    def search(self, query, topic=None, since=None, limit=20):
+        """return the (topic, date, snippet) of the entries matching the
+        full-text query"""
+
+        import pyjournal2.search_util as search_util
+        return search_util.search(query, self.defs, topic=topic, since=since, limit=limit)
+
+    def query(self, tags=None, fields=None, topic=None, since=None):
+        """return the (topic, date, fields) of the entries with the tags
+        and (name, value) metadata fields"""
+
+        import pyjournal2.meta_util as meta_util
+        return meta_util.query(self.defs, tags=tags, fields=fields, topic=topic, since=since)
+
+    # building and exporting
+
+    def write_tocs(self):
+        """write the TOC files of all of the topics, the timeline and the
+        index, without running Sphinx"""
+        build_util.write_tocs(self.defs)
+
+    def build(self, clean=False, jobs=None, profile=False):
+        """build the HTML version of the journal"""
+        build_util.build(self.defs, clean=clean, jobs=jobs, profile=profile)
+
+    def partial_build(self, topics=None, since=None, until=None, clean=False, jobs=None):
+        """build some topics and dates into build/partial/html"""
+        build_util.partial_build(self.defs, topics=topics, since=since, until=until,
+                                 clean=clean, jobs=jobs)
+
+    def export(self, output, fmt=None, topics=None):
+        """export the journal to a jsonl, tar, zip, latex or pdf file"""
+
+        import pyjournal2.export_util as export_util
+        export_util.export(output, self.defs, fmt=fmt, topics=topics)
+
+    # the remote repos
+
+    def pull(self):
+        """pull the changes from the master repo"""
+
+        import pyjournal2.git_util as git_util
+        git_util.pull(self.defs)
+
+    def push(self):
+        """push the local commits to the master repo"""
+
+        import pyjournal2.git_util as git_util
+        git_util.push(self.defs)
+
+    def sync(self, timeout=None):
+        """sync with the master repo and all of the other remotes"""
+
+        import pyjournal2.git_util as git_util
+        git_util.sync(self.defs, timeout=timeout)
@@ -2,14 +2,67 @@
 main driver for the journal
 """
 
-import argparse
-import configparser
 import os
 import sys
 
-import pyjournal2.build_util as build_util
-import pyjournal2.entry_util as entry_util
-import pyjournal2.git_util as git_util
+# the other modules (and argparse / configparser) are only imported
+# when a command needs them, to keep the startup time low for quick
+# entries
+
+# the commands that are sent to the daemon ("pyjournal.py serve") if it
+# is running.  Anything that needs the terminal runs locally.
+DAEMON_COMMANDS = ["build", "search", "query", "status"]
+
+def is_topic(name, defs):
+    """return True if name is an existing topic.  This only looks for the
+    one directory, so it is much cheaper than getting the list of
+    topics"""
+
+    try:
+        source_dir = "{}/journal-{}/source/".format(defs["working_path"], defs["nickname"])
+    except KeyError:
+        # we are doing init or connect, so there are no keys yet
+        return False
+
+    return not name.startswith(("_", "-", ".")) and os.path.isdir(os.path.join(source_dir, name))
+
+def get_fields(field_args):
+    """turn the name=value strings from --field into a list of (name,
+    value) (with value None if there is no "=")"""
+
+    if not field_args:
+        return []
+
+    import re
+
+    fields = []
+    for f in field_args:
+        name, sep, value = f.partition("=")
+        if not re.match(r"^[A-Za-z][\w\-]*$", name):
+            sys.exit("ERROR: invalid field name: {}".format(name))
+        fields.append((name, value if sep else None))
+    return fields
+
+def get_links(patterns):
+    """return the files to link from the --link arguments, expanding any
+    glob patterns (in the order given, without duplicates)"""
+
+    import glob
+
+    links = []
+    for p in patterns:
+        p = os.path.expanduser(p)
+        if glob.has_magic(p):
+            matches = sorted(glob.glob(p))
+            if not matches:
+                sys.exit("ERROR: no files match {}".format(p))
+        else:
+            matches = [p]
+
+        for m in matches:
+            if m not in links:
+                links.append(m)
+    return links
 
 def get_args(defs):
     """ parse the commandline arguments """
@@ -18,26 +71,31 @@ def get_args(defs):
     # entry, and we don't take any arguments, and we don't do an
     # argparse
 
-    try:
-        topics = build_util.get_topics(defs)
-    except KeyError:
-        # we are doing init or connect, so there are no keys yet
-        topics = []
-
     if len(sys.argv) == 1:  # the command name is first argument
         args = {"command": "entry",
                 "images": [],
-                "link": None,
+                "link": [],
+                "tag": None,
+                "field": None,
                 "topic": "main"}
 
-    elif len(sys.argv) == 2 and sys.argv[-1] in topics:
+    elif len(sys.argv) == 2 and is_topic(sys.argv[-1], defs):
         args = {"command": "entry",
                 "images": [],
-                "link": None,
+                "link": [],
+                "tag": None,
+                "field": None,
                 "topic": sys.argv[-1]}
 
     else:
+        import argparse
+
         p = argparse.ArgumentParser()
+        # (this is taken out of the commandline before we get here, by
+        # get_journal_arg(), but is listed for the help)
+        p.add_argument("--journal", metavar="name",
+                       help="the journal to use, from the .pyjournal2rc (default: the one in [main])",
+                       type=str, default=None)
         sp = p.add_subparsers(title="subcommands",
                               description="valid subcommands",
                               help="subcommands (use -h to see options for each)",
@@ -69,8 +127,14 @@ def get_args(defs):
         # the entry command
         entry_ps = sp.add_parser("entry",
                                  help="add a new entry, with optional images")
-        entry_ps.add_argument("--link", metavar="link-files",
-                              help="files to link in the entry",
+        entry_ps.add_argument("--link", metavar="link-files", action="append",
+                              help="a file (or a quoted glob pattern) to link in the entry (can be given more than once)",
+                              type=str, default=[])
+        entry_ps.add_argument("--tag", metavar="tag", action="append",
+                              help="add a tag to the entry's metadata (can be given more than once)",
+                              type=str, default=None)
+        entry_ps.add_argument("--field", metavar="name=value", action="append",
+                              help="add a field to the entry's metadata (can be given more than once)",
                               type=str, default=None)
         entry_ps.add_argument("topic", help="the name of the topic to add to",
                               nargs="?", default="main", type=str)
@@ -80,17 +144,110 @@ def get_args(defs):
         # the continue command
         cont_ps = sp.add_parser("continue",
                                 help="continue working on the last entry (from a different day), with optional images")
-        cont_ps.add_argument("--link", metavar="link-files",
-                             help="files to link in the entry",
+        cont_ps.add_argument("--link", metavar="link-files", action="append",
+                             help="a file (or a quoted glob pattern) to link in the entry (can be given more than once)",
+                             type=str, default=[])
+        cont_ps.add_argument("--tag", metavar="tag", action="append",
+                             help="add a tag to the entry's metadata (can be given more than once)",
+                             type=str, default=None)
+        cont_ps.add_argument("--field", metavar="name=value", action="append",
+                             help="add a field to the entry's metadata (can be given more than once)",
                              type=str, default=None)
         cont_ps.add_argument("topic", help="the name of the topic to add to",
                              nargs="?", default="main", type=str)
         cont_ps.add_argument("images", help="images to include as figures in the entry",
                              nargs="*", default=None, type=str)
 
+        # the import command
+        import_ps = sp.add_parser("import",
+                                  help="import many entries, figures and files at once from a JSON manifest or a topic/YYYY-MM-DD/ directory tree")
+        import_ps.add_argument("source",
+                               help="a JSON manifest or the root of a topic/YYYY-MM-DD/ directory tree",
+                               nargs=1, default=None, type=str)
+
+        # the search command
+        search_ps = sp.add_parser("search",
+                                  help="search the text of the entries")
+        search_ps.add_argument("--topic", metavar="topic",
+                               help="only search this topic",
+                               type=str, default=None)
+        search_ps.add_argument("--since", metavar="YYYY-MM-DD",
+                               help="only search entries from this date on",
+                               type=str, default=None)
+        search_ps.add_argument("--limit", metavar="N",
+                               help="the maximum number of results",
+                               type=int, default=20)
+        search_ps.add_argument("query", help="the words to search for",
+                               nargs="+", type=str)
+
+        # the query command
+        query_ps = sp.add_parser("query",
+                                 help="list the entries with the given tags and metadata fields")
+        query_ps.add_argument("--tag", metavar="tag", action="append",
+                              help="only list entries with this tag (can be given more than once)",
+                              type=str, default=None)
+        query_ps.add_argument("--field", metavar="name[=value]", action="append",
+                              help="only list entries with this field (and value) (can be given more than once)",
+                              type=str, default=None)
+        query_ps.add_argument("--topic", metavar="topic",
+                              help="only list entries in this topic",
+                              type=str, default=None)
+        query_ps.add_argument("--since", metavar="YYYY-MM-DD",
+                              help="only list entries from this date on",
+                              type=str, default=None)
+
         # the build command
         build_ps = sp.add_parser("build",
-                                 help="build a PDF of the journal")
+                                 help="build the HTML version of the journal")
+        build_ps.add_argument("--jobs", "-j", metavar="N",
+                              help="number of parallel Sphinx processes (default: the jobs setting in .pyjournal2rc, or the number of cores)",
+                              type=int, default=None)
+        build_ps.add_argument("--clean", action="store_true",
+                              help="do a 'make clean' before building, instead of an incremental build")
+        build_ps.add_argument("--profile", action="store_true",
+                              help="write the timings and the size of the topics and pages to build/html/build-profile.json")
+        build_ps.add_argument("--all", action="store_true",
+                              help="build all of the journals in the .pyjournal2rc, several at once (--jobs is then the total number of Sphinx processes)")
+        build_ps.add_argument("--topic", metavar="topic", action="append",
+                              help="only build this topic, into build/partial/html (can be given more than once)",
+                              type=str, default=None)
+        build_ps.add_argument("--since", metavar="YYYY-MM-DD",
+                              help="only build the entries from this date on, into build/partial/html",
+                              type=str, default=None)
+        build_ps.add_argument("--until", metavar="YYYY-MM-DD",
+                              help="only build the entries up to this date, into build/partial/html",
+                              type=str, default=None)
+
+        # the export command
+        export_ps = sp.add_parser("export",
+                                  help="export the journal to a JSON Lines file, a tar or zip archive, or LaTeX / PDF")
+        export_ps.add_argument("--format", choices=["jsonl", "tar", "tar.gz", "zip", "latex", "pdf"],
+                               help="the export format (default: from the extension of the output file)",
+                               type=str, default=None)
+        export_ps.add_argument("--topic", metavar="topic", action="append",
+                               help="only export this topic (can be given more than once)",
+                               type=str, default=None)
+        export_ps.add_argument("output",
+                               help="the file to write (- for stdout)",
+                               type=str)
+
+        # the serve command
+        serve_ps = sp.add_parser("serve",
+                                 help="run a daemon that keeps the journal in memory, to speed up later commands")
+        serve_ps.add_argument("--stop", action="store_true",
+                              help="stop the running daemon")
+
+        # the watch command
+        watch_ps = sp.add_parser("watch",
+                                 help="serve the journal webpage and rebuild it whenever an entry changes")
+        watch_ps.add_argument("--port", metavar="port",
+                              help="the port to serve the webpage on (default: 8000)",
+                              type=int, default=8000)
+        watch_ps.add_argument("--jobs", "-j", metavar="N",
+                              help="number of parallel Sphinx processes",
+                              type=int, default=None)
+        watch_ps.add_argument("--no-browser", action="store_true",
+                              help="don't open the webpage in a browser")
 
         # the pull command
         pull_ps = sp.add_parser("pull",
@@ -100,45 +257,183 @@ def get_args(defs):
         push_ps = sp.add_parser("push",
                                 help="push local changes to the remote journal")
 
+        # the sync command
+        sync_ps = sp.add_parser("sync",
+                                help="pull from and push to the master repo and all of the remotes in the .pyjournal2rc, concurrently")
+        sync_ps.add_argument("--timeout", metavar="seconds",
+                             help="the time limit for each git command on a remote (default: 60)",
+                             type=float, default=None)
+
         # the status command
         stat_ps = sp.add_parser("status",
                                 help="list the current journal information")
 
         # the show command
         show_ps = sp.add_parser("show",
-                                help="build the PDF and launch a PDF viewer")
+                                help="build the HTML version of the journal and open it in a web browser")
+        show_ps.add_argument("--jobs", "-j", metavar="N",
+                             help="number of parallel Sphinx processes (default: the jobs setting in .pyjournal2rc, or the number of cores)",
+                             type=int, default=None)
+        show_ps.add_argument("--clean", action="store_true",
+                             help="do a 'make clean' before building, instead of an incremental build")
 
         args = vars(p.parse_args())
 
     return args
 
-def read_config():
-    """ parse the .pyjournal2rc file -- store the results in a dictionary
-        e.g., defs["working_path"] """
+# the optional settings in the .pyjournal2rc and the ConfigParser
+# method that reads each
+OPTIONS = {"jobs": "getint",
+           "layout": "get",
+           "attachment_store": "getboolean",
+           "thumbnail_size": "getint",
+           "auto_publish": "getboolean",
+           "sync_timeout": "getfloat",
+           "large_file_size": "getint",
+           "large_files": "get"}
+
+def get_param_file():
+    """return the default .pyjournal2rc"""
+    return os.path.expanduser("~") + "/.pyjournal2rc"
+
+def get_journal_arg():
+    """remove a "--journal name" from the commandline and return the
+    name (or None).  This is needed before we read the configuration,
+    so it is done before the argparse."""
+
+    for n, a in enumerate(sys.argv):
+        if a == "--journal" and n+1 < len(sys.argv):
+            name = sys.argv[n+1]
+            del sys.argv[n:n+2]
+            return name
+        if a.startswith("--journal="):
+            del sys.argv[n]
+            return a.split("=", 1)[1]
+    return None
+
+def get_journal_sections(cp):
+    """return a dictionary of journal name (nickname): section for the
+    journals in the configuration, the default journal first.  The
+    default journal is in the [main] section and any others are in
+    [journal:name] sections."""
+
+    sections = {}
+    if cp.has_option("main", "nickname"):
+        sections[cp.get("main", "nickname")] = "main"
+    for s in cp.sections():
+        if s.startswith("journal:"):
+            sections[s.split(":", 1)[1]] = s
+    return sections
+
+def read_config(param_file=None, journal=None):
+    """ parse the .pyjournal2rc file (or param_file) -- store the results
+        in a dictionary e.g., defs["working_path"].  If journal is
+        given, the settings are for the journal of that name, otherwise
+        for the default journal. """
     defs = {}
-    defs["param_file"] = os.path.expanduser("~") + "/.pyjournal2rc"
+    if param_file is None:
+        param_file = get_param_file()
+    defs["param_file"] = param_file
     defs["module_dir"] = os.path.abspath(os.path.dirname(__file__))
 
-    if os.path.isfile(defs["param_file"]):
-        cp = configparser.ConfigParser()
-        cp.optionxform = str
-        cp.read(defs["param_file"])
+    if not os.path.isfile(defs["param_file"]):
+        if journal is not None:
+            sys.exit("ERROR: no journal named {}, {} does not exist".format(journal, param_file))
+        return defs
 
-        defs["working_path"] = cp.get("main", "working_path")
-        defs["master_repo"] = cp.get("main", "master_repo")
-        defs["nickname"] = cp.get("main", "nickname")
-        try:
-            defs["username"] = cp.get("main", "username")
-        except:
-            pass
+    import configparser
+
+    cp = configparser.ConfigParser()
+    cp.optionxform = str
+    cp.read(defs["param_file"])
+
+    sections = get_journal_sections(cp)
+    defs["journals"] = list(sections)
+
+    if not sections:
+        return defs
+
+    if journal is None:
+        journal = defs["journals"][0]
+    elif journal not in sections:
+        sys.exit("ERROR: no journal named {} in {}".format(journal, param_file))
+
+    section = sections[journal]
+    defs["journal"] = journal
+
+    defs["working_path"] = cp.get(section, "working_path")
+    defs["master_repo"] = cp.get(section, "master_repo")
+    defs["nickname"] = cp.get(section, "nickname", fallback=journal)
+    if cp.has_option(section, "username"):
+        defs["username"] = cp.get(section, "username")
+
+    # the settings in [main] apply to all of the journals, unless the
+    # journal's own section changes them
+    for s in ["main", section]:
+        for option, method in OPTIONS.items():
+            if cp.has_option(s, option):
+                defs[option] = getattr(cp, method)(s, option)
+
+    # additional remote repos that we sync with (the name = the git
+    # url), in [remotes] for the default journal and [remotes:name]
+    # for the others
+    remotes = "remotes" if section == "main" else "remotes:{}".format(journal)
+    if cp.has_section(remotes):
+        defs["remotes"] = dict(cp.items(remotes))
 
     return defs
 
+def add_journal(param_file, nickname, master_repo, working_path, username=None):
+    """add a journal to the .pyjournal2rc, creating it if needed.  The
+    first journal goes in the [main] section and any others in
+    [journal:nickname] sections, so an existing configuration is never
+    overwritten."""
+
+    import configparser
+
+    cp = configparser.ConfigParser()
+    cp.optionxform = str
+    try:
+        cp.read(param_file)
+    except configparser.Error as e:
+        sys.exit("ERROR: unable to read {}: {}".format(param_file, e))
+
+    sections = get_journal_sections(cp)
+    if nickname in sections:
+        sys.exit("ERROR: a journal named {} already exists in {}".format(nickname, param_file))
+
+    if cp.has_section("main"):
+        section = "journal:{}".format(nickname)
+    else:
+        section = "main"
+
+    try:
+        with open(param_file, "a") as f:
+            if cp.sections():
+                f.write("\n")
+            f.write("[{}]\n".format(section))
+            f.write("master_repo = {}\n".format(master_repo))
+            f.write("working_path = {}\n".format(working_path))
+            f.write("nickname = {}\n".format(nickname))
+            if username is not None:
+                f.write("username = {}\n".format(username))
+    except OSError:
+        sys.exit("ERROR: unable to open {} for appending".format(param_file))
+
 def main(args, defs):
     """ main interface """
 
     action = args["command"]
 
+    # if the daemon is running, let it do the work
+    if action in DAEMON_COMMANDS and not defs.get("daemon") and "nickname" in defs:
+        import pyjournal2.serve_util as serve_util
+        rc = serve_util.forward(args, defs)
+        if rc is not None:
+            if rc != 0:
+                sys.exit(rc)
+            return
+
     if action == "init":
         nickname = args["nickname"][0]
         username = args["username"][0]
@@ -150,6 +445,7 @@ def main(args, defs):
         master_path = os.path.normpath(os.path.expanduser(master_path))
         working_path = os.path.normpath(os.path.expanduser(working_path))
 
+        import pyjournal2.git_util as git_util
         git_util.init(nickname, username, master_path, working_path, defs)
 
     elif action == "connect":
@@ -157,23 +453,27 @@ def main(args, defs):
         working_path = args["working-path"][0]
         working_path = os.path.normpath(os.path.expanduser(working_path))
 
+        import pyjournal2.git_util as git_util
         git_util.connect(master_repo, working_path, defs)
 
     elif action == "entry":
         images = args["images"]
         topic = args["topic"]
-        link_file = args["link"]
+        link_files = get_links(args["link"])
+
+        import pyjournal2.entry_util as entry_util
 
         # check if the topic exists.  If not, ask if we want to create it
-        topics = build_util.get_topics(defs)
-        if topic not in topics:
+        if not is_topic(topic, defs):
             create = input("topic {} does not exist, create? [y]  ".format(topic))
             if create == "":
                 create = "y"
             if create.lower() == "y":
+                import pyjournal2.build_util as build_util
                 build_util.create_topic(topic, defs)
 
-        entry_util.entry(topic, images, link_file, defs)
+        entry_util.entry(topic, images, link_files, defs,
+                         tags=args["tag"], fields=get_fields(args["field"]))
 
     elif action == "continue":
         # this is basically the same as entry, but we pass in the name
@@ -183,25 +483,98 @@ def main(args, defs):
 
         images = args["images"]
         topic = args["topic"]
-        link_file = args["link"]
+        link_files = get_links(args["link"])
+
+        import pyjournal2.build_util as build_util
+        import pyjournal2.entry_util as entry_util
 
         # get the entry id of the last entry for this topic
         _, entries = build_util.get_topic_entries(topic, defs)
 
-        entry_util.entry(topic, images, link_file, defs, use_date=entries[-1])
+        entry_util.entry(topic, images, link_files, defs, use_date=entries[-1],
+                         tags=args["tag"], fields=get_fields(args["field"]))
+
+    elif action == "import":
+        import pyjournal2.import_util as import_util
+        import_util.import_entries(args["source"][0], defs)
+
+    elif action == "search":
+        import pyjournal2.search_util as search_util
+
+        # only highlight the matches on a terminal
+        highlight = ("", "")
+        if sys.stdout.isatty():
+            import pyjournal2.entry_util as entry_util
+            highlight = (entry_util.BOLD, entry_util.ENDC)
+
+        hits = search_util.search(" ".join(args["query"]), defs,
+                                  topic=args["topic"], since=args["since"],
+                                  limit=args["limit"], highlight=highlight)
+
+        for topic, date, snippet in hits:
+            print("{}/{}: {}".format(topic, date, " ".join(snippet.split())))
+
+        if not hits:
+            print("no matches")
+
+    elif action == "query":
+        import pyjournal2.meta_util as meta_util
+        hits = meta_util.query(defs, tags=args["tag"], fields=get_fields(args["field"]),
+                               topic=args["topic"], since=args["since"])
+
+        for topic, date, fields in hits:
+            print("{}/{}: {}".format(topic, date,
+                                     "  ".join("{}={}".format(name, ",".join(values))
+                                               for name, values in fields.items())))
+
+        if not hits:
+            print("no matches")
 
     elif action == "build":
-        build_util.build(defs)
+        import pyjournal2.build_util as build_util
+        if args["all"]:
+            build_util.build_all(defs, clean=args["clean"], jobs=args["jobs"])
+        elif args["topic"] or args["since"] or args["until"]:
+            build_util.partial_build(defs, topics=args["topic"], since=args["since"],
+                                     until=args["until"], clean=args["clean"],
+                                     jobs=args["jobs"])
+        else:
+            build_util.build(defs, clean=args["clean"], jobs=args["jobs"],
+                             profile=args["profile"])
 
     elif action == "show":
-        build_util.build(defs, show=1)
+        import pyjournal2.build_util as build_util
+        build_util.build(defs, show=1, clean=args["clean"], jobs=args["jobs"])
+
+    elif action == "export":
+        import pyjournal2.export_util as export_util
+        export_util.export(args["output"], defs, fmt=args["format"],
+                           topics=args["topic"])
+
+    elif action == "serve":
+        import pyjournal2.serve_util as serve_util
+        if args["stop"]:
+            serve_util.stop(defs)
+        else:
+            serve_util.serve(defs)
+
+    elif action == "watch":
+        import pyjournal2.watch_util as watch_util
+        watch_util.watch(defs, port=args["port"], jobs=args["jobs"],
+                         browser=not args["no_browser"])
 
     elif action == "pull":
+        import pyjournal2.git_util as git_util
         git_util.pull(defs)
 
     elif action == "push":
+        import pyjournal2.git_util as git_util
         git_util.push(defs)
 
+    elif action == "sync":
+        import pyjournal2.git_util as git_util
+        git_util.sync(defs, timeout=args["timeout"])
+
     elif action == "status":
 
         print("pyjournal2")
@@ -211,10 +584,44 @@ def main(args, defs):
         except KeyError:
             sys.exit("Error: no journal found")
 
+        if len(defs.get("journals", [])) > 1:
+            print("  journal: {}  (also: {})".format(defs["journal"],
+                                                   ", ".join(j for j in defs["journals"]
+                                                             if j != defs["journal"])))
         print("  working directory: {}/journal-{}".format(wp, nickname))
         print("  master git repo: {}".format(defs["master_repo"]))
+        for name, url in defs.get("remotes", {}).items():
+            print("  remote {}: {}".format(name, url))
+        print(" ")
+
+        # a summary of the topics, from the entry index
+        import pyjournal2.build_util as build_util
+        for topic in sorted(build_util.get_topics(defs)):
+            years, entries = build_util.get_topic_entries(topic, defs)
+            if entries:
+                print("  {}: {} entries ({} - {})".format(topic, len(entries),
+                                                        entries[0], entries[-1]))
+            else:
+                print("  {}: no entries".format(topic))
         print(" ")
 
+        # pushes waiting in the auto-publish queue
+        import pyjournal2.publish_util as publish_util
+        queue = publish_util.read_queue(defs)
+        if queue:
+            if publish_util.worker_running(defs):
+                state = "being pushed"
+            else:
+                state = "not being pushed -- run push or sync"
+            print("  {} queued push(es), {}".format(len(queue), state))
+            for _, request in queue:
+                line = "    {} {}".format(request["commit"], request["message"])
+                if request["attempts"] > 0:
+                    line += "  ({} failed attempt(s): {})".format(request["attempts"],
+                                                                 request["error"])
+                print(line)
+            print(" ")
+
     else:
         # we should never land here, because of the choices argument
         # to actions in the argparser
@@ -0,0 +1,168 @@
+"""This module keeps an index of the metadata of the journal entries and
+queries it.
+
+The metadata of an entry is a ReST field list in the entry text,
+e.g.:
+
+  :tags: sims, castro
+  :project: xrb
+  :run: 123
+
+A field can appear more than once (e.g. when an entry is continued),
+and the tags field is a comma-separated list, with each tag stored
+separately.  The index is a SQLite database in the working journal's
+.git/ directory.  Before each query, only the entry files whose mtime
+or size changed since the last query are parsed again.
+
+"""
+
+import os
+import re
+import sqlite3
+
+import pyjournal2.build_util as build_util
+import pyjournal2.index_util as index_util
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    topic TEXT,
+    date TEXT,
+    mtime INTEGER,
+    size INTEGER
+);
+CREATE TABLE IF NOT EXISTS fields (
+    path TEXT,
+    name TEXT,
+    value TEXT COLLATE NOCASE
+);
+CREATE INDEX IF NOT EXISTS fields_name_value ON fields (name, value);
+CREATE INDEX IF NOT EXISTS fields_path ON fields (path);
+"""
+
+# a field list line -- fields indented under a directive are the
+# directive's options, not metadata
+FIELD_RE = re.compile(r"^:([A-Za-z][\w\-]*):(?:\s+(.*))?$")
+
+# fields whose value is a comma-separated list
+LIST_FIELDS = ["tags"]
+
+
+def connect(defs):
+    """open (creating if needed) the metadata database"""
+
+    db_file = os.path.join(index_util.get_state_dir(defs), "meta.db")
+    db = sqlite3.connect(db_file)
+    db.executescript(SCHEMA)
+    return db
+
+
+def parse_fields(text):
+    """return a list of (name, value) for the fields in the text of an
+    entry"""
+
+    fields = []
+    for line in text.split("\n"):
+        m = FIELD_RE.match(line.rstrip())
+        if not m:
+            continue
+
+        name = m.group(1).lower()
+        value = (m.group(2) or "").strip()
+
+        if name in LIST_FIELDS:
+            fields += [(name, v.strip()) for v in value.split(",") if v.strip()]
+        else:
+            fields.append((name, value))
+
+    return fields
+
+
+def field_text(tags=None, fields=None):
+    """return the ReST field list for the given tags and (name, value)
+    fields, for adding to an entry"""
+
+    ftext = ""
+    if tags:
+        ftext += ":tags: {}\n".format(", ".join(tags))
+    for name, value in fields or []:
+        ftext += ":{}: {}\n".format(name, value or "")
+
+    if ftext:
+        ftext += "\n"
+    return ftext
+
+
+def update(defs, db):
+    """bring the metadata index up to date with the entry files.  Return
+    the number of entries that were (re)parsed."""
+
+    known = {}
+    for path, mtime, size in db.execute("SELECT path, mtime, size FROM files"):
+        known[path] = (mtime, size)
+
+    changed, removed = index_util.changed_entries(defs, known)
+
+    source_dir = build_util.get_source_dir(defs)
+
+    with db:
+        for path, topic, e, mtime, size in changed:
+            with open(os.path.join(source_dir, path), "r", errors="replace") as f:
+                fields = parse_fields(f.read())
+
+            db.execute("DELETE FROM fields WHERE path = ?", (path,))
+            db.executemany("INSERT INTO fields VALUES (?, ?, ?)",
+                           [(path, name, value) for name, value in fields])
+            db.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)",
+                       (path, topic, e, mtime, size))
+
+        # forget about entries that were removed
+        for path in removed:
+            db.execute("DELETE FROM fields WHERE path = ?", (path,))
+            db.execute("DELETE FROM files WHERE path = ?", (path,))
+
+    return len(changed) + len(removed)
+
+
+def query(defs, tags=None, fields=None, topic=None, since=None):
+    """return a list of (topic, date, fields) for the entries that have
+    all of the tags and all of the (name, value) fields, in date
+    order.  A value of None matches any value of the field.  The
+    fields returned are a dictionary of name: list of values."""
+
+    db = connect(defs)
+    update(defs, db)
+
+    sql = "SELECT path, topic, date FROM files WHERE 1"
+    params = []
+
+    conditions = [("tags", t) for t in tags or []] + list(fields or [])
+    for name, value in conditions:
+        if value is None:
+            sql += " AND EXISTS (SELECT 1 FROM fields WHERE fields.path = files.path AND name = ?)"
+            params.append(name.lower())
+        else:
+            sql += " AND EXISTS (SELECT 1 FROM fields WHERE fields.path = files.path AND name = ? AND value = ?)"
+            params += [name.lower(), value]
+
+    if topic is not None:
+        sql += " AND topic = ?"
+        params.append(topic)
+
+    if since is not None:
+        sql += " AND date >= ?"
+        params.append(since)
+
+    sql += " ORDER BY date, topic"
+
+    hits = []
+    for path, t, date in db.execute(sql, params).fetchall():
+        efields = {}
+        for name, value in db.execute("SELECT name, value FROM fields WHERE path = ? ORDER BY rowid",
+                                      (path,)):
+            efields.setdefault(name, []).append(value)
+        hits.append((t, date, efields))
+
+    db.close()
+
+    return hits
@@ -0,0 +1,231 @@
+"""This module implements the optional auto-publish mode (auto_publish
+= true in the .pyjournal2rc): after a new entry is committed, a push
+is added to a queue and a detached background worker pushes it, so
+the command returns as soon as the local commit is done.
+
+The queue is a directory in the journal's state directory, with one
+small JSON file per queued commit, so it survives crashes and reboots.
+Only one worker runs at a time (it holds a lock file).  Since a push
+sends all of the local commits, a successful push clears every request
+that was queued before it.  A failed push is retried with an
+exponential backoff, and after MAX_ATTEMPTS failures the worker gives
+up, leaving the requests in the queue.  They are shown by
+"pyjournal.py status" and are retried the next time an entry is
+published (or cleared by a manual push or sync).
+
+"""
+
+import fcntl
+import json
+import os
+import subprocess
+import sys
+import time
+
+import pyjournal2.index_util as index_util
+import pyjournal2.shell_util as shell_util
+
+# the worker gives up after this many failed pushes in a row
+MAX_ATTEMPTS = 8
+
+# the delay before the first retry (in seconds), doubling after each
+# failure up to BACKOFF_MAX
+BACKOFF_START = 5
+BACKOFF_MAX = 300
+
+# the time limit for a single push
+PUSH_TIMEOUT = 120
+
+
+def get_queue_dir(defs):
+    """return the directory holding the queued pushes"""
+    qdir = os.path.join(index_util.get_state_dir(defs), "push-queue")
+    os.makedirs(qdir, exist_ok=True)
+    return qdir
+
+
+def get_lock_file(defs):
+    """return the file the worker holds a lock on while running"""
+    return os.path.join(index_util.get_state_dir(defs), "push-worker.lock")
+
+
+def write_request(filename, request):
+    """write a queue file atomically"""
+    tmp_file = "{}.{}.tmp".format(filename, os.getpid())
+    with open(tmp_file, "w") as f:
+        json.dump(request, f)
+    os.replace(tmp_file, filename)
+
+
+def read_queue(defs):
+    """return a list of (filename, request) for the queued pushes, oldest
+    first"""
+
+    qdir = get_queue_dir(defs)
+    queue = []
+    for name in sorted(os.listdir(qdir)):
+        if not name.endswith(".json"):
+            continue
+        filename = os.path.join(qdir, name)
+        try:
+            with open(filename, "r") as f:
+                queue.append((filename, json.load(f)))
+        except (OSError, ValueError):
+            # removed by the worker while we were reading, or a
+            # leftover from a crash
+            continue
+    return queue
+
+
+def enqueue(defs, message):
+    """add a push of the current HEAD to the queue"""
+
+    stdout, _, _ = shell_util.run("git rev-parse --short HEAD",
+                                  cwd=index_util.get_journal_dir(defs))
+
+    request = {"commit": stdout.strip(),
+               "message": message.split("\n")[0],
+               "queued": time.strftime("%Y-%m-%d %H:%M:%S"),
+               "attempts": 0,
+               "error": ""}
+
+    filename = os.path.join(get_queue_dir(defs), "{}.json".format(time.time_ns()))
+    write_request(filename, request)
+
+
+def start_worker(defs):
+    """start a detached worker to drain the queue.  If one is already
+    running, the new one exits right away."""
+
+    log_file = os.path.join(index_util.get_state_dir(defs), "push-worker.log")
+
+    # make sure the worker can import us, however we were run
+    env = dict(os.environ)
+    package_dir = os.path.dirname(defs["module_dir"])
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [package_dir, env.get("PYTHONPATH")]))
+
+    with open(log_file, "a") as log:
+        subprocess.Popen([sys.executable, "-m", "pyjournal2.publish_util",
+                          defs["working_path"], defs["nickname"]],
+                         stdin=subprocess.DEVNULL, stdout=log, stderr=log,
+                         env=env, start_new_session=True)
+
+
+def queue_push(defs, message):
+    """queue a push of the commit just made and make sure a worker is
+    running to do it"""
+    enqueue(defs, message)
+    start_worker(defs)
+
+
+def worker_running(defs):
+    """return True if a worker is draining the queue.  This reads the
+    pid the worker writes in the lock file, rather than trying the
+    lock, which would make a worker starting at that moment exit."""
+
+    try:
+        with open(get_lock_file(defs), "r") as lf:
+            pid = int(lf.read().strip() or 0)
+    except (OSError, ValueError):
+        return False
+
+    if pid <= 0:
+        return False
+
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def clear(defs):
+    """remove all of the queued pushes (after a successful push)"""
+    for filename, _ in read_queue(defs):
+        try:
+            os.remove(filename)
+        except OSError:
+            pass
+
+
+def drain(defs):
+    """push until the queue is empty, retrying with a backoff, or until
+    MAX_ATTEMPTS pushes in a row have failed"""
+
+    failures = 0
+
+    while True:
+        queue = read_queue(defs)
+        if not queue:
+            return
+
+        _, stderr, rc = shell_util.run("git push", timeout=PUSH_TIMEOUT,
+                                       cwd=index_util.get_journal_dir(defs))
+
+        if rc == 0:
+            # this push included every commit queued before it
+            for filename, _ in queue:
+                # a manual push or sync may have cleared it already
+                try:
+                    os.remove(filename)
+                except FileNotFoundError:
+                    pass
+            print("{}: pushed {} queued commit(s)".format(time.strftime("%Y-%m-%d %H:%M:%S"),
+                                                          len(queue)))
+            failures = 0
+            continue
+
+        failures += 1
+        error = stderr.strip().split("\n")[0] if stderr.strip() else "git push failed"
+        print("{}: push failed: {}".format(time.strftime("%Y-%m-%d %H:%M:%S"), error))
+
+        for filename, request in queue:
+            request["attempts"] += 1
+            request["error"] = error
+            if os.path.exists(filename):
+                write_request(filename, request)
+
+        if failures >= MAX_ATTEMPTS:
+            print("giving up after {} attempts".format(failures))
+            return
+
+        time.sleep(min(BACKOFF_MAX, BACKOFF_START * 2**(failures-1)))
+
+
+def worker(defs):
+    """the background worker: drain the queue, unless another worker is
+    already doing that"""
+
+    wd = index_util.get_journal_dir(defs)
+    if not os.path.isdir(wd):
+        sys.exit("ERROR: the working directory {} does not exist".format(wd))
+
+    while True:
+        with open(get_lock_file(defs), "a") as lf:
+            try:
+                fcntl.flock(lf, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                return
+
+            # let status know we are running (see worker_running())
+            lf.truncate(0)
+            lf.write("{}\n".format(os.getpid()))
+            lf.flush()
+
+            try:
+                drain(defs)
+            finally:
+                lf.truncate(0)
+
+        # a push could have been queued after we found the queue
+        # empty but before we released the lock, when the worker
+        # started for it would have exited right away
+        queue = read_queue(defs)
+        if not queue or queue[-1][1]["attempts"] >= MAX_ATTEMPTS:
+            return
+
+
+if __name__ == "__main__":
+    worker({"working_path": sys.argv[1], "nickname": sys.argv[2]})
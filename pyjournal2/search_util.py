@@ -0,0 +1,133 @@
+"""This module maintains a full-text search index of the journal
+entries and searches it.
+
+The index is a SQLite FTS5 database in the working journal's .git/
+directory.  Before each search, only the entry files whose mtime or
+size changed since the last search are (re)indexed.
+
+"""
+
+import os
+import re
+import sqlite3
+import sys
+
+import pyjournal2.build_util as build_util
+import pyjournal2.entry_util as entry_util
+import pyjournal2.index_util as index_util
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    topic TEXT,
+    date TEXT,
+    mtime INTEGER,
+    size INTEGER
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS entries USING fts5(
+    path UNINDEXED,
+    topic UNINDEXED,
+    date UNINDEXED,
+    body,
+    tokenize = 'porter unicode61'
+);
+"""
+
+
+def connect(defs):
+    """open (creating if needed) the search database"""
+
+    db_file = os.path.join(index_util.get_state_dir(defs), "search.db")
+
+    try:
+        db = sqlite3.connect(db_file)
+        db.executescript(SCHEMA)
+    except sqlite3.OperationalError as e:
+        sys.exit("ERROR: unable to create the search index ({}). "
+                 "Your SQLite may not have FTS5 support.".format(e))
+
+    return db
+
+
+def read_body(filename):
+    """return the text of an entry, without the boilerplate that is in
+    every entry"""
+
+    with open(filename, "r", errors="replace") as f:
+        body = f.read()
+    body = body.replace(entry_util.SYMBOLS.strip(), "")
+
+    # drop the section adornment lines (like "=====")
+    return re.sub(r"^([=*#\-~^])\1+\s*$", "", body, flags=re.MULTILINE)
+
+
+def update(defs, db):
+    """bring the search index up to date with the entry files.  Return
+    the number of entries that were (re)indexed."""
+
+    known = {}
+    for path, mtime, size in db.execute("SELECT path, mtime, size FROM files"):
+        known[path] = (mtime, size)
+
+    changed, removed = index_util.changed_entries(defs, known)
+
+    source_dir = build_util.get_source_dir(defs)
+
+    with db:
+        for path, topic, e, mtime, size in changed:
+            body = read_body(os.path.join(source_dir, path))
+
+            db.execute("DELETE FROM entries WHERE path = ?", (path,))
+            db.execute("INSERT INTO entries (path, topic, date, body) VALUES (?, ?, ?, ?)",
+                       (path, topic, e, body))
+            db.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)",
+                       (path, topic, e, mtime, size))
+
+        # forget about entries that were removed
+        for path in removed:
+            db.execute("DELETE FROM entries WHERE path = ?", (path,))
+            db.execute("DELETE FROM files WHERE path = ?", (path,))
+
+    return len(changed) + len(removed)
+
+
+def quote_query(query):
+    """turn a query into a plain list of terms, for when it is not valid
+    FTS5 query syntax"""
+    return " ".join('"{}"'.format(t.replace('"', '""')) for t in query.split())
+
+
+def search(query, defs, topic=None, since=None, limit=20, highlight=("", "")):
+    """return a list of (topic, date, snippet) for the entries matching
+    query, best matches first.  The query can use the SQLite FTS5
+    syntax (e.g., AND, OR, NOT, "a phrase", prefix*).  The matches in
+    the snippets are put between the two strings in highlight (by
+    default, they are not marked)."""
+
+    db = connect(defs)
+    update(defs, db)
+
+    sql = ("SELECT topic, date, snippet(entries, 3, ?, ?, '...', 16) "
+           "FROM entries WHERE entries MATCH ?")
+    params = [highlight[0], highlight[1], query]
+
+    if topic is not None:
+        sql += " AND topic = ?"
+        params.append(topic)
+
+    if since is not None:
+        sql += " AND date >= ?"
+        params.append(since)
+
+    sql += " ORDER BY rank LIMIT ?"
+    params.append(limit)
+
+    try:
+        hits = db.execute(sql, params).fetchall()
+    except sqlite3.OperationalError:
+        params[2] = quote_query(query)
+        hits = db.execute(sql, params).fetchall()
+
+    db.close()
+
+    return hits
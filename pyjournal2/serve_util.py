@@ -0,0 +1,186 @@
+"""This module implements an optional daemon ("pyjournal.py serve")
+that keeps the configuration, the entry index and a Sphinx
+application in memory, so repeated commands and builds don't pay the
+startup and environment loading costs each time.
+
+The daemon listens on a Unix socket.  The CLI forwards the commands
+that don't need a terminal (see main_util.DAEMON_COMMANDS) to it when
+it is running, and otherwise runs them itself, as usual.  A request
+is a single line of JSON with the parsed arguments, and the reply is a
+single line of JSON with the output and the return code.
+
+"""
+
+import contextlib
+import io
+import json
+import os
+import socket
+import socketserver
+import sys
+
+import pyjournal2.index_util as index_util
+import pyjournal2.main_util as main_util
+
+
+def get_socket_path(defs):
+    """return the path of the daemon's socket.  This is in the journal's
+    state directory (not a shared temporary directory), so no one else
+    can put a socket there for us to send our commands to."""
+    return os.path.join(index_util.get_state_dir(defs), "daemon.sock")
+
+
+def forward(args, defs):
+    """send a command to the daemon, if it is running, and print its
+    output.  Return the command's return code, or None if there is no
+    daemon to send it to."""
+
+    try:
+        sock_path = get_socket_path(defs)
+    except OSError:
+        # the working journal is missing
+        return None
+
+    if not os.path.exists(sock_path):
+        return None
+
+    request = {"args": args}
+
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+            s.connect(sock_path)
+            s.sendall((json.dumps(request) + "\n").encode("utf-8"))
+            with s.makefile("r", encoding="utf-8") as f:
+                reply = json.loads(f.readline())
+    except (OSError, ValueError):
+        # the daemon is not running (or went away), so the caller
+        # should run the command itself
+        return None
+
+    sys.stdout.write(reply["output"])
+    return reply["rc"]
+
+
+class JournalServer(socketserver.UnixStreamServer):
+    """the daemon: it handles one request at a time, so the commands
+    never run concurrently"""
+
+    def __init__(self, sock_path, defs):
+        self.defs = defs
+        self.param_mtime = self.get_param_mtime()
+        self.shutdown_requested = False
+        super().__init__(sock_path, RequestHandler)
+
+    def get_param_mtime(self):
+        """return the mtime of the .pyjournal2rc, so we know when to reread it"""
+        try:
+            return os.stat(self.defs["param_file"]).st_mtime_ns
+        except OSError:
+            return None
+
+    def get_defs(self):
+        """return the journal configuration, rereading it if the
+        .pyjournal2rc changed"""
+
+        mtime = self.get_param_mtime()
+        if mtime != self.param_mtime:
+            self.defs = main_util.read_config(self.defs["param_file"],
+                                              journal=self.defs.get("journal"))
+            self.param_mtime = mtime
+
+        # tell the commands they are running in the daemon
+        defs = dict(self.defs)
+        defs["daemon"] = True
+        return defs
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    """run a single command sent by the CLI"""
+
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline())
+        except ValueError:
+            return
+
+        if request.get("shutdown"):
+            self.reply("pyjournal2 daemon stopping\n", 0)
+            self.server.shutdown_requested = True
+            return
+
+        output = io.StringIO()
+        rc = 0
+
+        # the commands use absolute paths from the configuration, so
+        # it doesn't matter where the CLI was run
+        try:
+            with contextlib.redirect_stdout(output), contextlib.redirect_stderr(output):
+                main_util.main(request["args"], self.server.get_defs())
+        except SystemExit as e:
+            if isinstance(e.code, str):
+                output.write(e.code + "\n")
+                rc = 1
+            else:
+                rc = e.code or 0
+        except Exception as e:
+            output.write("ERROR: {}: {}\n".format(type(e).__name__, e))
+            rc = 1
+
+        self.reply(output.getvalue(), rc)
+
+    def reply(self, output, rc):
+        """send the output and return code back to the CLI"""
+        reply = {"output": output, "rc": rc}
+        self.wfile.write((json.dumps(reply) + "\n").encode("utf-8"))
+
+
+def serve(defs):
+    """run the daemon in the foreground until it is stopped (with
+    "serve --stop" or Ctrl-C)"""
+
+    sock_path = get_socket_path(defs)
+
+    if os.path.exists(sock_path):
+        # is there a daemon on it already, or is this left over?
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+            try:
+                s.connect(sock_path)
+                sys.exit("ERROR: a pyjournal2 daemon is already running on {}".format(sock_path))
+            except OSError:
+                os.remove(sock_path)
+
+    # the socket is only usable by us from the moment it is made
+    old_umask = os.umask(0o177)
+    try:
+        server = JournalServer(sock_path, defs)
+    except OSError as e:
+        sys.exit("ERROR: unable to listen on {}: {}".format(sock_path, e))
+    finally:
+        os.umask(old_umask)
+
+    print("pyjournal2 daemon listening on {}".format(sock_path))
+
+    try:
+        while not server.shutdown_requested:
+            server.handle_request()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if os.path.exists(sock_path):
+            os.remove(sock_path)
+
+
+def stop(defs):
+    """ask a running daemon to stop"""
+
+    sock_path = get_socket_path(defs)
+
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+            s.connect(sock_path)
+            s.sendall((json.dumps({"shutdown": True}) + "\n").encode("utf-8"))
+            with s.makefile("r", encoding="utf-8") as f:
+                print(json.loads(f.readline())["output"], end="")
+    except (OSError, ValueError):
+        sys.exit("ERROR: no pyjournal2 daemon is running")
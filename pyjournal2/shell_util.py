@@ -1,25 +1,139 @@
 """routines for interacting with the command shell"""
 
+import os
 import shlex
+import signal
 import subprocess
+import threading
+import time
 
-def run(string):
-    """run a command and capture the output and return code"""
+# functions called as hook(command, seconds, rc) after each command
+# finishes (see add_timing_hook())
+_timing_hooks = []
+
+
+def add_timing_hook(hook):
+    """call hook(command, seconds, rc) after every command we run, so the
+    caller can see where the wall time goes"""
+    _timing_hooks.append(hook)
+
+
+def remove_timing_hook(hook):
+    """stop calling a hook added with add_timing_hook()"""
+    _timing_hooks.remove(hook)
+
+
+class timing:
+    """a context manager that collects a (command, seconds, rc) record
+    for each command run inside it:
+
+        with shell_util.timing() as records:
+            ...
+    """
+
+    def __enter__(self):
+        self.records = []
+        add_timing_hook(self.record)
+        return self.records
+
+    def __exit__(self, *args):
+        remove_timing_hook(self.record)
+
+    def record(self, command, seconds, rc):
+        self.records.append((command, seconds, rc))
+
+
+def _kill(p0):
+    """kill a command started in its own process group, and any
+    children it started (like the ssh that git runs)"""
+    try:
+        os.killpg(p0.pid, signal.SIGKILL)
+    except OSError:
+        pass
+
+
+def run(string, line_callback=None, timeout=None, cwd=None, env=None, interactive=False):
+    """run a command and capture the output and return code.
+
+    If line_callback is given, it is called with each line of output
+    as it arrives (stderr merged into stdout), so the progress of a
+    long command can be followed, and the output is not kept (stdout
+    and stderr are returned empty).  If the command takes longer than
+    timeout seconds, it is killed and the return code is -1.  The
+    command runs in directory cwd (default: the current directory)
+    with the environment variables in env added to ours.  An
+    interactive command (like an editor) is given the terminal, and
+    nothing is captured."""
 
     # shlex.split will preserve inner quotes
     prog = shlex.split(string)
-    if prog[0] == "vi":
-        # vi hangs when piping stdout/stderr
-        p0 = subprocess.Popen(prog)
-        stdout0, stderr0 = p0.communicate()
-        rc = p0.returncode
+
+    if env is not None:
+        env = dict(os.environ, **env)
+
+    t0 = time.perf_counter()
+
+    if interactive or prog[0] == "vi":
+        # editors hang when piping stdout/stderr
+        p0 = subprocess.Popen(prog, cwd=cwd, env=env)
+        rc = p0.wait()
+        stdout = ""
+        stderr = ""
 
     else:
-        p0 = subprocess.Popen(prog, stdout=subprocess.PIPE,
-                              stderr=subprocess.PIPE)
-        stdout0, stderr0 = p0.communicate()
-        rc = p0.returncode
-        stdout = stdout0.decode('utf-8')
-        stderr = stderr0.decode('utf-8')
+        # the command gets its own process group, so a timeout can
+        # kill everything it started
+        p0 = subprocess.Popen(prog, cwd=cwd, env=env,
+                              stdout=subprocess.PIPE,
+                              stderr=subprocess.STDOUT if line_callback else subprocess.PIPE,
+                              start_new_session=timeout is not None)
+
+        timer = None
+        timed_out = threading.Event()
+        if timeout is not None:
+            def expire():
+                timed_out.set()
+                _kill(p0)
+            timer = threading.Timer(timeout, expire)
+            timer.daemon = True
+            timer.start()
+
+        try:
+            if line_callback is not None:
+                for l in p0.stdout:
+                    line_callback(l.decode('utf-8', errors='replace'))
+                rc = p0.wait()
+                stdout = ""
+                stderr = ""
+            else:
+                stdout0, stderr0 = p0.communicate()
+                rc = p0.returncode
+                stdout = stdout0.decode('utf-8', errors='replace')
+                stderr = stderr0.decode('utf-8', errors='replace')
+        finally:
+            if timer is not None:
+                timer.cancel()
+
+        if timed_out.is_set():
+            stderr += "timed out after {} s\n".format(timeout)
+            rc = -1
+
+    dt = time.perf_counter() - t0
+    for hook in list(_timing_hooks):
+        hook(string, dt, rc)
 
     return stdout, stderr, rc
+
+
+def run_many(strings, max_workers=None, **kwargs):
+    """run several independent commands concurrently (each with the
+    keyword arguments of run()) and return the list of their (stdout,
+    stderr, rc), in the same order as the commands"""
+
+    if not strings:
+        return []
+
+    import concurrent.futures
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers or len(strings)) as pool:
+        return list(pool.map(lambda s: run(s, **kwargs), strings))
@@ -0,0 +1,313 @@
+"""This module manages a local, content-addressed store of the files
+attached to entries.  Each distinct file is stored once, under its
+SHA-256 hash, and the copies in the entry directories are hardlinks
+to it, so attaching the same file many times does not use any more
+disk space.  (git itself stores identical files as a single blob.)
+
+The store lives in the working journal's .git/ directory, so it is
+never committed.  Stored files are made read-only, since editing one
+in place would change every entry that links to it.
+
+Files are copied without passing the data through Python: a reflink
+(a copy-on-write clone, on btrfs, XFS, ...) if the filesystem can do
+it, otherwise os.copy_file_range() or os.sendfile() in large chunks,
+so the progress of a big copy can be shown.  Files are hashed through
+a memory map.
+
+Files of at least large_file_size MB (in the .pyjournal2rc, 0 = off)
+are kept out of git entirely: the file in the entry directory is
+ignored (through .git/info/exclude) and a small pointer file,
+name.ref, is committed in its place, recording the SHA-256 hash, size
+and origin of the file.  With large_files = store (the default), the
+file is hardlinked from the store, like any other attachment; with
+large_files = link, it is a symlink to the original file, which must
+then stay where it is.
+
+"""
+
+import fcntl
+import hashlib
+import mmap
+import os
+import shutil
+import sys
+import threading
+
+import pyjournal2.index_util as index_util
+
+CHUNK_SIZE = 1024*1024
+
+# the amount copied by each copy_file_range() / sendfile() call (and
+# so how often the progress of a copy is updated)
+COPY_CHUNK = 64*1024*1024
+
+# copies (and hashes) of files at least this size show their progress
+PROGRESS_SIZE = 256*1024*1024
+
+# the ioctl for cloning a file (FICLONE in linux/fs.h)
+FICLONE = 0x40049409
+
+LARGE_FILE_MODES = ["store", "link"]
+
+# the extension of the pointer file committed for a large file
+REF_EXT = ".ref"
+
+# serializes the updates of .git/info/exclude by our threads
+_exclude_lock = threading.Lock()
+
+
+def get_store_dir(defs):
+    """return the directory holding the stored objects"""
+    sdir = os.path.join(index_util.get_state_dir(defs), "objects")
+    if not os.path.isdir(sdir):
+        os.makedirs(sdir, exist_ok=True)
+    return sdir
+
+
+def use_store(defs):
+    """return True if attachments should go through the store (the
+    attachment_store option in the .pyjournal2rc, on by default)"""
+    return defs.get("attachment_store", True)
+
+
+def get_large_file_size(defs):
+    """return the size (in bytes) from which a file is kept out of git,
+    or 0 if all files are committed"""
+    return max(0, defs.get("large_file_size", 0))*1024*1024
+
+
+def get_large_files(defs):
+    """return how large files are kept: "store" (in the store) or
+    "link" (a symlink to the original file)"""
+
+    mode = defs.get("large_files", "store")
+    if mode not in LARGE_FILE_MODES:
+        sys.exit("ERROR: invalid large_files {}, should be one of {}".format(
+            mode, ", ".join(LARGE_FILE_MODES)))
+    return mode
+
+
+def show_progress(name, done, total):
+    """show how far along the copy (or hash) of a large file is, on a
+    single line that is cleared when it is done"""
+
+    if not sys.stdout.isatty():
+        return
+
+    if done >= total:
+        sys.stdout.write("\r\033[K")
+    else:
+        sys.stdout.write("\r\033[K{}: {:.1f} of {:.1f} GB ({:.0f}%)".format(
+            name, done/1024**3, total/1024**3, 100.0*done/total))
+    sys.stdout.flush()
+
+
+def file_hash(filename):
+    """return the SHA-256 hex digest of a file, read through a memory
+    map, so the data is not copied into Python"""
+
+    h = hashlib.sha256()
+    with open(filename, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return h.hexdigest()
+
+        name = os.path.basename(filename)
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            view = memoryview(m)
+            try:
+                for offset in range(0, size, COPY_CHUNK):
+                    h.update(view[offset:offset+COPY_CHUNK])
+                    if size >= PROGRESS_SIZE:
+                        show_progress("hashing " + name, min(offset+COPY_CHUNK, size), size)
+            finally:
+                view.release()
+
+    return h.hexdigest()
+
+
+def copy_data(src, dest):
+    """copy the contents of the file src to dest.  A reflink is tried
+    first, then the kernel copies the data (copy_file_range, or
+    sendfile across filesystems), with a plain read / write loop as a
+    last resort."""
+
+    with open(src, "rb") as fsrc, open(dest, "wb") as fdest:
+        size = os.fstat(fsrc.fileno()).st_size
+        if size == 0:
+            return
+
+        try:
+            fcntl.ioctl(fdest.fileno(), FICLONE, fsrc.fileno())
+            return
+        except OSError:
+            pass
+
+        name = "copying " + os.path.basename(src)
+        progress = size >= PROGRESS_SIZE
+
+        # sendfile only writes to regular files on Linux
+        methods = []
+        if hasattr(os, "copy_file_range"):
+            methods.append("copy_file_range")
+        if sys.platform.startswith("linux"):
+            methods.append("sendfile")
+
+        copied = 0
+        for method in methods + [None]:
+            try:
+                while copied < size:
+                    if method == "copy_file_range":
+                        n = os.copy_file_range(fsrc.fileno(), fdest.fileno(), COPY_CHUNK)
+                    elif method == "sendfile":
+                        n = os.sendfile(fdest.fileno(), fsrc.fileno(), None, COPY_CHUNK)
+                    else:
+                        buf = fsrc.read(CHUNK_SIZE)
+                        fdest.write(buf)
+                        n = len(buf)
+                    if n == 0:
+                        break
+                    copied += n
+                    if progress:
+                        show_progress(name, copied, size)
+                break
+            except OSError:
+                # the kernel can't copy these files this way (e.g.,
+                # across filesystems), so we try the next way -- but an
+                # error part way through, or in the plain copy, is real
+                if copied > 0 or method is None:
+                    raise
+
+        if progress:
+            show_progress(name, size, size)
+
+
+def same_file(a, b):
+    """return True if files a and b have the same content"""
+
+    try:
+        sa = os.stat(a)
+        sb = os.stat(b)
+    except OSError:
+        return False
+
+    if sa.st_size != sb.st_size:
+        return False
+
+    if (sa.st_dev, sa.st_ino) == (sb.st_dev, sb.st_ino):
+        return True
+
+    return file_hash(a) == file_hash(b)
+
+
+def store(src, defs, digest=None):
+    """add the file src to the store (if it is not already there) and
+    return the path of the stored object"""
+
+    if digest is None:
+        digest = file_hash(src)
+
+    odir = os.path.join(get_store_dir(defs), digest[:2])
+    obj = os.path.join(odir, digest)
+
+    # the size is a cheap check that the object was not modified
+    if os.path.isfile(obj) and os.path.getsize(obj) == os.path.getsize(src):
+        return obj
+
+    os.makedirs(odir, exist_ok=True)
+
+    # copy to a temporary name and then move it into place, so the
+    # store never has a partial object
+    tmp = "{}.{}.{}.tmp".format(obj, os.getpid(), threading.get_ident())
+    copy_data(src, tmp)
+    os.chmod(tmp, 0o444)
+    os.replace(tmp, obj)
+
+    return obj
+
+
+def copy(src, dest):
+    """copy the file src to dest, with its permissions (like
+    shutil.copy)"""
+    copy_data(src, dest)
+    shutil.copymode(src, dest)
+
+
+def exclude(path, defs):
+    """make git ignore path (relative to the working journal
+    directory) in this clone, through .git/info/exclude"""
+
+    info_dir = os.path.join(index_util.get_journal_dir(defs), ".git", "info")
+    os.makedirs(info_dir, exist_ok=True)
+    exclude_file = os.path.join(info_dir, "exclude")
+
+    pattern = "/" + path.replace(os.sep, "/")
+
+    with _exclude_lock:
+        try:
+            with open(exclude_file, "r") as f:
+                if pattern in f.read().split("\n"):
+                    return
+        except OSError:
+            pass
+
+        with open(exclude_file, "a") as f:
+            f.write(pattern + "\n")
+
+
+def place_large(src, dest, defs):
+    """put a large file src at dest, keeping it out of git, and write
+    its pointer file.  Return the pointer file."""
+
+    mode = get_large_files(defs)
+
+    lines = ["pyjournal2 large file",
+             "size {}".format(os.path.getsize(src))]
+
+    if mode == "store":
+        digest = file_hash(src)
+        obj = store(src, defs, digest=digest)
+        try:
+            os.link(obj, dest)
+        except OSError:
+            copy_data(obj, dest)
+        lines.append("oid sha256:{}".format(digest))
+    else:
+        os.symlink(os.path.abspath(src), dest)
+
+    lines.append("source {}".format(os.path.abspath(src)))
+
+    journal_dir = index_util.get_journal_dir(defs)
+    exclude(os.path.relpath(dest, journal_dir), defs)
+
+    ref = dest + REF_EXT
+    with open(ref, "w") as f:
+        f.write("\n".join(lines) + "\n")
+
+    return ref
+
+
+def place(src, dest, defs):
+    """put a copy of the file src at dest and return the file to commit
+    for it.  If the store is enabled, src is stored first and dest
+    becomes a hardlink to the stored object, falling back to a regular
+    copy if the link fails (e.g., across filesystems).  A large file
+    (see get_large_file_size()) is kept out of git and its pointer file
+    is returned instead."""
+
+    large = get_large_file_size(defs)
+    if large and os.path.getsize(src) >= large:
+        return place_large(src, dest, defs)
+
+    if not use_store(defs):
+        copy(src, dest)
+        return dest
+
+    obj = store(src, defs)
+
+    try:
+        os.link(obj, dest)
+    except OSError:
+        copy(src, dest)
+
+    return dest
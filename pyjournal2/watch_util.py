@@ -0,0 +1,199 @@
+"""This module implements "pyjournal.py watch": watch the journal
+sources for changes, rebuild only what is affected, and serve the
+HTML with a small web server that reloads the page after each
+rebuild.
+
+Changes are found by polling the mtimes of the entry directories and
+files.  A burst of saves is collected into a single rebuild, which
+regenerates the TOC files of the affected topics only and then runs an
+incremental Sphinx build (using an in-memory Sphinx application, like
+the daemon).
+
+"""
+
+import functools
+import http.server
+import os
+import threading
+import time
+
+import pyjournal2.build_util as build_util
+import pyjournal2.index_util as index_util
+
+# the URL the pages poll to find out about rebuilds
+RELOAD_URL = "/__pyjournal2_reload"
+
+RELOAD_SCRIPT = """
+<script>
+(function() {{
+  var version = "{version}";
+  setInterval(function() {{
+    fetch("{url}").then(function(r) {{ return r.text(); }}).then(function(v) {{
+      if (v !== version) {{ location.reload(); }}
+    }}).catch(function() {{}});
+  }}, 1000);
+}})();
+</script>
+"""
+
+
+def snapshot(defs):
+    """return a dictionary mapping each file in the entry directories
+    (and each entry and topic directory) to its (mtime, size).  The
+    generated TOC files are not included, since we write those
+    ourselves."""
+
+    source_dir = build_util.get_source_dir(defs)
+    snap = {}
+
+    for t in os.scandir(source_dir):
+        if not t.is_dir() or t.name.startswith("_"):
+            continue
+        snap[t.name] = (None, None)
+
+        for e in os.scandir(t.path):
+            if not e.is_dir():
+                continue
+            st = e.stat()
+            snap[os.path.join(t.name, e.name)] = (st.st_mtime_ns, None)
+
+            for f in os.scandir(e.path):
+                try:
+                    st = f.stat()
+                except OSError:
+                    continue
+                snap[os.path.join(t.name, e.name, f.name)] = (st.st_mtime_ns, st.st_size)
+
+    # the configuration (which can't clash with a topic name, since
+    # those don't start with "_")
+    for f in ["conf.py", "mathsymbols.tex"]:
+        try:
+            st = os.stat(os.path.join(source_dir, f))
+            snap[os.path.join("_config", f)] = (st.st_mtime_ns, st.st_size)
+        except OSError:
+            pass
+
+    return snap
+
+
+def changed_topics(old, new):
+    """return the set of topics with changes between two snapshots (a
+    change outside of a topic counts as all topics)"""
+
+    changed = set()
+    for path in set(old) | set(new):
+        if old.get(path) != new.get(path):
+            topic = path.split(os.sep)[0]
+            if topic == "_config":
+                return None
+            changed.add(topic)
+    return changed
+
+
+class ReloadHandler(http.server.SimpleHTTPRequestHandler):
+    """serve the HTML, adding a script to each page that reloads it when
+    the journal is rebuilt"""
+
+    # set by watch() -- the number of builds done so far
+    version = 0
+
+    def do_GET(self):
+        if self.path == RELOAD_URL:
+            self.send_text(str(ReloadHandler.version), "text/plain")
+            return
+
+        path = self.translate_path(self.path)
+        if os.path.isdir(path):
+            path = os.path.join(path, "index.html")
+
+        if not path.endswith(".html") or not os.path.isfile(path):
+            super().do_GET()
+            return
+
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            page = f.read()
+
+        script = RELOAD_SCRIPT.format(version=ReloadHandler.version, url=RELOAD_URL)
+        if "</body>" in page:
+            page = page.replace("</body>", script + "</body>", 1)
+        else:
+            page += script
+
+        self.send_text(page, "text/html")
+
+    def send_text(self, text, content_type):
+        """send text as the (uncached) response"""
+        data = text.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "{}; charset=utf-8".format(content_type))
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("Cache-Control", "no-store")
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        # keep the terminal for the build output
+        pass
+
+
+def watch(defs, port=8000, interval=0.5, debounce=0.5, jobs=None, browser=True):
+    """watch the sources and rebuild when they change, serving the HTML on
+    http://localhost:port/ until interrupted"""
+
+    # keep Sphinx in memory between the builds
+    defs = dict(defs)
+    defs["daemon"] = True
+
+    html_dir = os.path.join(index_util.get_journal_dir(defs), "build", "html")
+
+    build_util.build(defs, jobs=jobs)
+    ReloadHandler.version += 1
+
+    handler = functools.partial(ReloadHandler, directory=html_dir)
+    server = http.server.ThreadingHTTPServer(("localhost", port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    url = "http://localhost:{}/".format(server.server_address[1])
+    print("serving the journal at {}  (Ctrl-C to stop)".format(url))
+
+    if browser:
+        import webbrowser
+        webbrowser.open_new_tab(url)
+
+    snap = snapshot(defs)
+
+    try:
+        while True:
+            time.sleep(interval)
+
+            new = snapshot(defs)
+            if new == snap:
+                continue
+
+            # wait for the burst of changes to end
+            while True:
+                time.sleep(debounce)
+                latest = snapshot(defs)
+                if latest == new:
+                    break
+                new = latest
+
+            topics = changed_topics(snap, new)
+
+            if topics is None:
+                print("configuration changed, rebuilding everything")
+            else:
+                print("changes in: {}".format(", ".join(sorted(topics))))
+
+            build_util.build(defs, jobs=jobs, changed_topics=topics)
+            ReloadHandler.version += 1
+
+            # the build writes the TOC files, which we don't watch,
+            # but it may also have touched the topic directories
+            snap = snapshot(defs)
+
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        server.server_close()
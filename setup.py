@@ -9,5 +9,6 @@ setup(name='pyjournal2',
       license='BSD',
       packages=find_packages(),
       scripts=["pyjournal.py"],
+      extras_require={"thumbnails": ["Pillow"]},
       package_data={"pyjournal2": ["sphinx_base/*", "sphinx_base/source/*", "sphinx_base/source/main/*", "sphinx_base/source/_static/*", "sphinx_base/source/_templates/*"]},
       zip_safe=False)